@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterable
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramMigrateToChat,
+    TelegramNotFound, TelegramRetryAfter,
+)
+from aiogram.methods import SendMessage
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database.models import OutboundMessage
+from app.utils.cache import TTLCache
+from app.utils.metrics import (
+    OUTBOUND_ENQUEUED, OUTBOUND_LAG_SECONDS, OUTBOUND_MESSAGES, OUTBOUND_PENDING,
+)
+
+# Ошибки, после которых повтор бессмыслен: бот заблокирован, чат удалён, кривой текст
+PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def try_take(self) -> float:
+        # 0 — токен взят; иначе через сколько секунд он появится
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        while (wait := self.try_take()) > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _encode_payload(chat_id: int, payload: dict[str, Any]) -> str:
+    # Проверяем payload при постановке: кривое сообщение падает у вызывающего, а не в рассылке
+    if not payload.get("text"):
+        raise ValueError("В payload нужен text")
+    method = SendMessage(chat_id=chat_id, **payload)
+    if method.model_extra:
+        raise ValueError(f"Неизвестные поля payload: {', '.join(method.model_extra)}")
+    return json.dumps(payload, ensure_ascii=False)
+
+class OutboundDispatcher:
+    # Исходящие рассылки идут через таблицу outbound_messages: сообщение переживает
+    # перезапуск, а отправка ограничена общим и по-чатовым token bucket.
+    # Лимиты считаются на процесс: при нескольких процессах global_rate делится между ними.
+    def __init__(
+        self,
+        session_pool: async_sessionmaker | None = None,
+        global_rate: float = 25,
+        chat_rate: float = 1,
+        batch_size: int = 100,
+        poll_interval: float = 1.0,
+        max_attempts: int = 5,
+        lease: timedelta = timedelta(minutes=5),
+    ):
+        self._session_pool = session_pool
+        self.chat_rate = chat_rate
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self._global = TokenBucket(global_rate)
+        self._chats = TTLCache(max_size=100_000, ttl=60)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def session_pool(self) -> async_sessionmaker:
+        # Движок создаётся при первом обращении: модуль импортируется и без DB_URL (бенчмарки)
+        if self._session_pool is None:
+            from app.database.engine import session_maker
+            self._session_pool = session_maker
+        return self._session_pool
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate)
+        # Перезаписываем, чтобы продлить ttl активного чата
+        self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def enqueue(self, chat_id: int, payload: dict[str, Any], session: AsyncSession | None = None) -> int:
+        # С session сообщение попадает в транзакцию вызывающего и уйдёт только после его commit
+        message = OutboundMessage(
+            chat_id=chat_id, payload=_encode_payload(chat_id, payload), status='pending', next_attempt_at=_utcnow()
+        )
+        if session is not None:
+            session.add(message)
+            await session.flush()
+        else:
+            async with self.session_pool() as own_session:
+                own_session.add(message)
+                await own_session.commit()
+
+        OUTBOUND_ENQUEUED.inc()
+        self._wakeup.set()
+        return message.id
+
+    async def enqueue_many(self, messages: Iterable[tuple[int, dict[str, Any]]], session: AsyncSession) -> int:
+        now = _utcnow()
+        rows = [
+            {"chat_id": chat_id, "payload": _encode_payload(chat_id, payload), "status": 'pending', "next_attempt_at": now}
+            for chat_id, payload in messages
+        ]
+        if rows:
+            await session.execute(insert(OutboundMessage), rows)
+            OUTBOUND_ENQUEUED.inc(len(rows))
+            self._wakeup.set()
+        return len(rows)
+
+    def start(self, bot: Bot):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot), name="outbound-dispatcher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, bot: Bot):
+        while True:
+            try:
+                handled = await self.process_batch(bot)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Ошибка в рассылке исходящих сообщений")
+                handled = 0
+
+            if not handled:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _claim(self, session: AsyncSession, now: datetime) -> list:
+        ids = (await session.scalars(
+            select(OutboundMessage.id)
+            .where(OutboundMessage.status == 'pending', OutboundMessage.next_attempt_at <= now)
+            .order_by(OutboundMessage.id)
+            .limit(self.batch_size)
+        )).all()
+        if not ids:
+            return []
+
+        # Аренда: пока пачка отправляется, другие процессы её не видят. Если процесс упадёт,
+        # строки вернутся после lease — доставка «хотя бы один раз»
+        rows = (await session.execute(
+            update(OutboundMessage)
+            .where(
+                OutboundMessage.id.in_(ids),
+                OutboundMessage.status == 'pending',
+                OutboundMessage.next_attempt_at <= now,
+            )
+            .values(next_attempt_at=now + self.lease)
+            .returning(
+                OutboundMessage.id, OutboundMessage.chat_id, OutboundMessage.payload,
+                OutboundMessage.attempts, OutboundMessage.created,
+            )
+            .execution_options(synchronize_session=False)
+        )).all()
+        await session.commit()
+        return sorted(rows, key=lambda row: row.id)
+
+    async def process_batch(self, bot: Bot) -> int:
+        async with self.session_pool() as session:
+            rows = await self._claim(session, _utcnow())
+            if not rows:
+                OUTBOUND_PENDING.set(await session.scalar(
+                    select(func.count()).select_from(OutboundMessage).where(OutboundMessage.status == 'pending')
+                ))
+                return 0
+
+            sent_ids = []
+            changes = []
+            # Чат, упёршийся в свой лимит, пропускаем до конца пачки — порядок его сообщений сохраняется
+            blocked: dict[int, datetime] = {}
+
+            try:
+                for row in rows:
+                    if row.chat_id in blocked:
+                        changes.append({"id": row.id, "next_attempt_at": blocked[row.chat_id]})
+                        continue
+
+                    wait = self._chat_bucket(row.chat_id).try_take()
+                    if wait > 0:
+                        blocked[row.chat_id] = _utcnow() + timedelta(seconds=wait)
+                        changes.append({"id": row.id, "next_attempt_at": blocked[row.chat_id]})
+                        continue
+
+                    await self._global.acquire()
+                    change = await self._send(bot, row)
+                    if change is None:
+                        sent_ids.append(row.id)
+                    else:
+                        changes.append(change)
+                        if change.get("status") != 'failed':
+                            blocked[row.chat_id] = change["next_attempt_at"]
+            finally:
+                # Итоги записываем и при остановке посреди пачки: иначе после lease
+                # уже доставленные сообщения ушли бы повторно
+                await self._save_results(session, sent_ids, changes)
+
+        return len(sent_ids)
+
+    async def _save_results(self, session: AsyncSession, sent_ids: list[int], changes: list[dict]):
+        if sent_ids:
+            await session.execute(
+                delete(OutboundMessage).where(OutboundMessage.id.in_(sent_ids))
+                .execution_options(synchronize_session=False)
+            )
+        if changes:
+            # Bulk UPDATE по первичному ключу: одна команда на все отложенные строки
+            await session.execute(update(OutboundMessage), changes)
+        await session.commit()
+
+    async def _send(self, bot: Bot, row) -> dict | None:
+        # None — отправлено; иначе изменения для строки очереди
+        now = _utcnow()
+        try:
+            await bot(SendMessage(chat_id=row.chat_id, **json.loads(row.payload)))
+        except TelegramRetryAfter as error:
+            OUTBOUND_MESSAGES.inc(result='retry_after')
+            # По ответу не понять, чей лимит превышен, поэтому притормаживаем и чат, и всю рассылку
+            self._chat_bucket(row.chat_id).pause(error.retry_after)
+            self._global.pause(error.retry_after)
+            return {"id": row.id, "next_attempt_at": now + timedelta(seconds=error.retry_after)}
+        except TelegramMigrateToChat as error:
+            OUTBOUND_MESSAGES.inc(result='retry')
+            return {"id": row.id, "chat_id": error.migrate_to_chat_id, "next_attempt_at": now}
+        except PERMANENT_ERRORS as error:
+            OUTBOUND_MESSAGES.inc(result='failed')
+            logging.warning("Сообщение %s в чат %s не доставлено: %s", row.id, row.chat_id, error.message)
+            return {"id": row.id, "status": 'failed', "attempts": row.attempts + 1, "last_error": error.message}
+        except TelegramAPIError as error:
+            # Сеть, 5xx Telegram: повторяем с экспоненциальной задержкой
+            attempts = row.attempts + 1
+            if attempts >= self.max_attempts:
+                OUTBOUND_MESSAGES.inc(result='failed')
+                return {"id": row.id, "status": 'failed', "attempts": attempts, "last_error": error.message}
+            OUTBOUND_MESSAGES.inc(result='retry')
+            delay = min(600, 2 ** attempts)
+            return {
+                "id": row.id, "attempts": attempts, "last_error": error.message,
+                "next_attempt_at": now + timedelta(seconds=delay),
+            }
+        except Exception as error:
+            # Любая другая ошибка (битый payload в базе и т.п.) повторится и дальше —
+            # помечаем строку, чтобы она не ломала остальную пачку
+            OUTBOUND_MESSAGES.inc(result='failed')
+            logging.exception("Сообщение %s в чат %s не доставлено", row.id, row.chat_id)
+            return {"id": row.id, "status": 'failed', "attempts": row.attempts + 1, "last_error": repr(error)}
+
+        OUTBOUND_MESSAGES.inc(result='sent')
+        created = row.created
+        if created is not None:
+            # SQLite возвращает время без часового пояса
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=timezone.utc)
+            OUTBOUND_LAG_SECONDS.observe(max(0.0, (now - created).total_seconds()))
+        return None
+
+outbound = OutboundDispatcher(
+    global_rate=float(os.getenv('OUTBOUND_RATE', '25')),
+    chat_rate=float(os.getenv('OUTBOUND_CHAT_RATE', '1')),
+    batch_size=int(os.getenv('OUTBOUND_BATCH_SIZE', '100')),
+    max_attempts=int(os.getenv('OUTBOUND_MAX_ATTEMPTS', '5')),
+)
+
+async def enqueue(chat_id: int, payload: dict[str, Any], session: AsyncSession | None = None) -> int:
+    return await outbound.enqueue(chat_id, payload, session=session)
@@ -1,8 +1,16 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
-from app.background.tasks import update_all_limits, delete_old_categories
+from app.background.tasks import (
+    update_all_limits, delete_old_categories, purge_expired_fsm_states, purge_failed_outbound,
+    send_limit_alerts, purge_stale_limit_alerts, backfill_amount_base, update_currency_rates,
+)
 from app.database.engine import session_maker 
+from app.database.currency_cache import refresh_currencies_if_changed
+from app.utils.rates import make_rate_provider
+
+rate_provider = make_rate_provider()
 
 async def scheduled_update_all_limits():
     async with session_maker() as session:
@@ -12,6 +20,34 @@ async def scheduled_delete_old_categories():
     async with session_maker() as session:
         await delete_old_categories(session)
 
+async def scheduled_refresh_currencies():
+    async with session_maker() as session:
+        await refresh_currencies_if_changed(session)
+
+async def scheduled_purge_fsm_states():
+    async with session_maker() as session:
+        await purge_expired_fsm_states(session)
+
+async def scheduled_purge_failed_outbound():
+    async with session_maker() as session:
+        await purge_failed_outbound(session)
+
+async def scheduled_purge_stale_limit_alerts():
+    async with session_maker() as session:
+        await purge_stale_limit_alerts(session)
+
+async def scheduled_backfill_amount_base():
+    async with session_maker() as session:
+        await backfill_amount_base(session)
+
+async def scheduled_update_currency_rates():
+    async with session_maker() as session:
+        await update_currency_rates(session, rate_provider)
+
+async def scheduled_send_limit_alerts():
+    async with session_maker() as session:
+        await send_limit_alerts(session)
+
 def setup_scheduler():
     scheduler = AsyncIOScheduler()
 
@@ -19,4 +55,22 @@ def setup_scheduler():
 
     scheduler.add_job(scheduled_delete_old_categories, CronTrigger(hour=3, minute=0))
 
+    scheduler.add_job(scheduled_refresh_currencies, IntervalTrigger(minutes=5))
+
+    scheduler.add_job(scheduled_purge_fsm_states, IntervalTrigger(hours=1))
+
+    scheduler.add_job(scheduled_purge_failed_outbound, CronTrigger(hour=3, minute=30))
+
+    scheduler.add_job(scheduled_send_limit_alerts, IntervalTrigger(minutes=15))
+
+    scheduler.add_job(scheduled_purge_stale_limit_alerts, CronTrigger(hour=3, minute=45))
+
+    # Без триггера — один раз сразу после старта (схема к этому моменту уже готова);
+    # бот не ждёт окончания заполнения
+    scheduler.add_job(scheduled_backfill_amount_base)
+
+    # Первый раз курсы загружаются в main до старта планировщика
+    if rate_provider is not None:
+        scheduler.add_job(scheduled_update_currency_rates, IntervalTrigger(hours=1))
+
     scheduler.start()
\ No newline at end of file
@@ -1,53 +1,438 @@
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import select
+from decimal import Decimal
+from sqlalchemy import Integer, and_, cast, delete, exists, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database.models import Limit, Category
+from app.background.outbound import outbound
+from app.database.currency_cache import get_currencies, refresh_currencies_if_changed
+from app.database.models import (
+    Category, Currency, CurrencyRate, DailyRollup, FsmRecord, Limit, LimitAlert, MonthlyRollup, OutboundMessage, Transaction, User,
+)
+from app.database.orm_query import (
+    insert_limit_alerts, limit_alert_reached, limit_alert_threshold, orm_rebuild_limit_spent,
+)
+from app.database.query_helper import add_days, dialect_insert, periods_elapsed
+from app.database.rollups import orm_apply_rollup
+from app.utils.metrics import LIMIT_ROLLOVER_CHUNKS, LIMIT_ROLLOVER_LIMITS, LIMIT_ROLLOVER_SECONDS
+from app.utils.rates import RateProvider
 
-from dateutil.relativedelta import relativedelta
+@dataclass
+class RolloverReport:
+    chunks: int = 0
+    rows: int = 0
+    backfilled: int = 0
+    elapsed: float = 0.0
 
-async def update_all_limits(session: AsyncSession):
-    stmt = select(Limit).where(
-        Limit.is_updating == True,
-        Limit.start_date.isnot(None)
+async def _backfill_period_days(session: AsyncSession) -> int:
+    # Старые лимиты хранят только строку "30d": переносим число дней в period_days
+    result = await session.execute(
+        update(Limit)
+        .where(Limit.period_days == None, Limit.period.like('%d'))
+        .values(period_days=cast(func.substr(Limit.period, 1, func.length(Limit.period) - 1), Integer))
+        .execution_options(synchronize_session=False)
     )
-    result = await session.execute(stmt)
-    limits = result.scalars().all()
+    await session.execute(
+        update(Limit)
+        .where(Limit.end_date == None, Limit.period_days > 0, Limit.start_date != None)
+        .values(end_date=add_days(session, Limit.start_date, Limit.period_days))
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    return result.rowcount
 
-    now = datetime.now()
+async def update_all_limits(session: AsyncSession, chunk_size: int = 5000) -> RolloverReport:
+    started = time.monotonic()
+    report = RolloverReport(backfilled=await _backfill_period_days(session))
+    LIMIT_ROLLOVER_LIMITS.inc(report.backfilled, result='backfilled')
+    now = datetime.now(timezone.utc)
 
-    for limit in limits:
-        period = limit.period.lower()
+    # Каждый просроченный лимит сдвигается сразу на нужное число периодов одним UPDATE
+    shift = Limit.period_days * (periods_elapsed(session, now, Limit.end_date, Limit.period_days) + 1)
+    seen = set()
 
-        if not period.endswith('d'):
-            continue 
+    while True:
+        # Продлённые лимиты выпадают из выборки сами, поэтому смещение по id не нужно
+        ids = (await session.scalars(
+            select(Limit.id)
+            .where(
+                Limit.is_updating == True,
+                Limit.period_days > 0,
+                Limit.end_date < now
+            )
+            .limit(chunk_size)
+        )).all()
+        if not ids or seen.issuperset(ids):
+            break
+        seen.update(ids)
 
-        try:
-            days = int(period[:-1])
-        except ValueError:
-            continue
+        await session.execute(
+            update(Limit)
+            .where(Limit.id.in_(ids))
+            .values(
+                start_date=add_days(session, Limit.start_date, shift),
+                end_date=add_days(session, Limit.end_date, shift),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        # Новый период: счётчик пересчитывается по тратам, попавшим в новое окно
+        await orm_rebuild_limit_spent(session, limit_ids=ids)
+        # Короткие транзакции на пачку — таблица не блокируется на всё время задачи
+        await session.commit()
+
+        report.chunks += 1
+        report.rows += len(ids)
+        # Счётчики растут по ходу: на долгом прогоне прогресс виден в /metrics, не только в логе
+        LIMIT_ROLLOVER_CHUNKS.inc()
+        LIMIT_ROLLOVER_LIMITS.inc(len(ids), result='shifted')
+        logging.info("Продление лимитов: пачка %s, всего %s", report.chunks, report.rows)
+
+    report.elapsed = time.monotonic() - started
+    LIMIT_ROLLOVER_SECONDS.observe(report.elapsed)
+    logging.info(
+        "Продление лимитов завершено: %s лимитов, %s пачек, %.2f с",
+        report.rows, report.chunks, report.elapsed
+    )
+    return report
+
+@dataclass
+class PurgeReport:
+    categories: int = 0
+    transactions: int = 0
+    limits: int = 0
+    rollups: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+
+def _purgeable_category(threshold_date: datetime):
+    return and_(
+        Category.is_deleted == True,
+        Category.deleted_at != None,
+        Category.deleted_at < threshold_date,
+    )
+
+async def _delete_by_category(
+    session: AsyncSession,
+    model,
+    user_id: int,
+    category_ids: list[int],
+    threshold_date: datetime,
+    rows_per_batch: int,
+    report: PurgeReport
+) -> int:
+    # Удаляем пачками по id: DELETE ... LIMIT нет в Postgres, а одна большая
+    # пачка держала бы блокировки и журнал до самого конца.
+    # user_id в условии — чтобы работал индекс (user_id, category_id, ...), а не полный скан
+    removed = 0
+    while True:
+        ids = (await session.scalars(
+            select(model.id)
+            .where(
+                model.user_id == user_id,
+                model.category_id.in_(category_ids),
+                # Категорию могли восстановить посреди очистки — её данные больше не трогаем
+                model.category_id.in_(select(Category.id).where(_purgeable_category(threshold_date))),
+            )
+            .limit(rows_per_batch)
+        )).all()
+        if not ids:
+            return removed
+
+        await session.execute(
+            delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+        removed += len(ids)
+        report.batches += 1
+
+async def delete_old_categories(
+    session: AsyncSession,
+    categories_per_batch: int = 100,
+    rows_per_batch: int = 5000
+) -> PurgeReport:
+    started = time.monotonic()
+    report = PurgeReport()
+    threshold_date = datetime.now(timezone.utc) - timedelta(days=30)
+
+    # ORM-объекты не загружаем: session.delete с cascade тянул бы в память все транзакции категории
+    while True:
+        rows = (await session.execute(
+            select(Category.id, Category.user_id)
+            .where(_purgeable_category(threshold_date))
+            .order_by(Category.user_id)
+            .limit(categories_per_batch)
+        )).all()
+        if not rows:
+            break
+
+        by_user: dict[int, list[int]] = defaultdict(list)
+        for category_id, user_id in rows:
+            by_user[user_id].append(category_id)
+
+        for user_id, category_ids in by_user.items():
+            purge = (user_id, category_ids, threshold_date, rows_per_batch, report)
+            report.transactions += await _delete_by_category(session, Transaction, *purge)
+            report.limits += await _delete_by_category(session, Limit, *purge)
+            for rollup in (DailyRollup, MonthlyRollup):
+                report.rollups += await _delete_by_category(session, rollup, *purge)
+
+        # Те же условия ещё раз: восстановленная за время очистки категория остаётся
+        result = await session.execute(
+            delete(Category)
+            .where(Category.id.in_([category_id for category_id, _ in rows]), _purgeable_category(threshold_date))
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        report.categories += result.rowcount
+
+    report.elapsed = time.monotonic() - started
+    logging.info(
+        "Очистка категорий: %s категорий, %s транзакций, %s лимитов, %s строк сводок, %s пачек, %.2f с",
+        report.categories, report.transactions, report.limits, report.rollups, report.batches, report.elapsed
+    )
+    return report
+
+async def purge_expired_fsm_states(session: AsyncSession, rows_per_batch: int = 5000) -> int:
+    # Брошенные на середине сценарии (ввод суммы, лимита и т.п.) удаляются по expires_at
+    now = datetime.now(timezone.utc)
+    removed = 0
+    while True:
+        ids = (await session.scalars(
+            select(FsmRecord.id).where(FsmRecord.expires_at < now).limit(rows_per_batch)
+        )).all()
+        if not ids:
+            break
+
+        await session.execute(
+            delete(FsmRecord).where(FsmRecord.id.in_(ids)).execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        removed += len(ids)
 
-        if not limit.end_date:
-            limit.end_date = limit.start_date + timedelta(days=days)
+    if removed:
+        logging.info("Удалено истёкших состояний FSM: %s", removed)
+    return removed
 
-        while limit.end_date < now:
-            limit.start_date += timedelta(days=days)
-            limit.end_date += timedelta(days=days)
+async def purge_failed_outbound(session: AsyncSession, keep_days: int = 7, rows_per_batch: int = 5000) -> int:
+    # Недоставленные сообщения храним неделю для разбора, дальше они только раздувают очередь
+    threshold_date = datetime.now(timezone.utc) - timedelta(days=keep_days)
+    removed = 0
+    while True:
+        ids = (await session.scalars(
+            select(OutboundMessage.id)
+            .where(OutboundMessage.status == 'failed', OutboundMessage.updated < threshold_date)
+            .limit(rows_per_batch)
+        )).all()
+        if not ids:
+            break
 
+        await session.execute(
+            delete(OutboundMessage).where(OutboundMessage.id.in_(ids)).execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        removed += len(ids)
+
+    if removed:
+        logging.info("Удалено недоставленных сообщений: %s", removed)
+    return removed
+
+def _limit_alert_text(row, threshold: int) -> str:
+    currency = get_currencies().get(row.currency_id)
+    symbol = currency.display if currency else ""
+    spent, limit_amount = Decimal(row.spent), Decimal(row.limit_amount)
+    percent = spent / limit_amount * 100
+
+    if threshold >= 100:
+        return (
+            f"❗️ Лимит по категории «{row.category_name}» исчерпан.\n"
+            f"Потрачено {spent:.2f}{symbol} из {limit_amount:.2f}{symbol} ({percent:.1f}%)."
+        )
+    return (
+        f"⚠️ По категории «{row.category_name}» использовано {percent:.1f}% лимита.\n"
+        f"Осталось {limit_amount - spent:.2f}{symbol}."
+    )
+
+async def send_limit_alerts(session: AsyncSession, batch_size: int = 1000) -> int:
+    # Счётчик limits.spent уже хранится в валюте лимита (пересчёт курсов делается в SQL
+    # при записи траты), поэтому все лимиты проверяются одним INSERT ... SELECT по limits
+    # без запросов на каждого пользователя. Запись в limit_alerts и постановка сообщения
+    # в очередь рассылки — одна транзакция: уведомление не теряется и не дублируется
+    await orm_rebuild_limit_spent(session, only_missing=True)
     await session.commit()
 
-async def delete_old_categories(session: AsyncSession):
     now = datetime.now(timezone.utc)
-    threshold_date = now - timedelta(days=30)
+    threshold = limit_alert_threshold()
+    already_sent = exists().where(
+        LimitAlert.limit_id == Limit.id,
+        LimitAlert.period_start == Limit.start_date,
+        LimitAlert.threshold >= threshold,
+    )
+    candidates = (
+        select(Limit.id, Limit.start_date, threshold)
+        .join(Category, Category.id == Limit.category_id)
+        .where(
+            Limit.start_date <= now,
+            (Limit.end_date == None) | (Limit.end_date >= now),
+            Category.is_deleted == False,
+            limit_alert_reached(),
+            ~already_sent,
+        )
+        .order_by(Limit.id)
+        .limit(batch_size)
+    )
 
-    stmt = select(Category).where(
-        Category.is_deleted == True,
-        Category.deleted_at != None,
-        Category.deleted_at < threshold_date
+    sent = 0
+    while True:
+        # Вставленные строки выпадают из candidates, поэтому следующая пачка — уже другие лимиты
+        inserted = dict((await session.execute(
+            insert_limit_alerts(session, candidates).returning(LimitAlert.limit_id, LimitAlert.threshold)
+        )).all())
+        if not inserted:
+            break
+
+        rows = (await session.execute(
+            select(
+                Limit.id, Limit.spent, Limit.limit_amount, Limit.currency_id,
+                Category.name.label("category_name"), User.tg_id,
+            )
+            .join(Category, Category.id == Limit.category_id)
+            .join(User, User.id == Limit.user_id)
+            .where(Limit.id.in_(inserted))
+        )).all()
+        await outbound.enqueue_many(
+            ((row.tg_id, {"text": _limit_alert_text(row, inserted[row.id])}) for row in rows), session
+        )
+        await session.commit()
+        sent += len(rows)
+
+    if sent:
+        logging.info("Уведомлений о лимитах поставлено в очередь: %s", sent)
+    return sent
+
+async def purge_stale_limit_alerts(session: AsyncSession) -> int:
+    # Отметки прошлых периодов и удалённых лимитов больше ничего не блокируют
+    result = await session.execute(
+        delete(LimitAlert)
+        .where(~exists().where(Limit.id == LimitAlert.limit_id, Limit.start_date == LimitAlert.period_start))
+        .execution_options(synchronize_session=False)
     )
-    result = await session.execute(stmt)
-    categories_to_delete = result.scalars().all()
+    await session.commit()
+    return result.rowcount
 
-    for category in categories_to_delete:
-        await session.delete(category)
+async def backfill_amount_base(session: AsyncSession, rows_per_batch: int = 5000) -> int:
+    # Транзакции, записанные до появления amount_base. Курс — текущий: ровно по нему
+    # отчёты и пересчитывали эти строки до сих пор. Идём по id, чтобы не сканировать
+    # заново уже заполненное начало таблицы
+    rate = select(Currency.rate_to_base).where(Currency.id == Transaction.currency_id).scalar_subquery()
+    last_id = 0
+    filled = 0
+    while True:
+        ids = (await session.scalars(
+            select(Transaction.id)
+            .where(
+                Transaction.id > last_id,
+                Transaction.amount_base == None,
+                Transaction.currency_id.in_(select(Currency.id)),
+            )
+            .order_by(Transaction.id)
+            .limit(rows_per_batch)
+        )).all()
+        if not ids:
+            break
+
+        filled_rows = (await session.execute(
+            update(Transaction)
+            .where(Transaction.id.in_(ids))
+            .values(amount_base=Transaction.amount * rate)
+            .returning(
+                Transaction.user_id, Transaction.category_id, Transaction.currency_id,
+                Transaction.is_expense, Transaction.created, Transaction.amount_base,
+            )
+            .execution_options(synchronize_session=False)
+        )).all()
+
+        # Пока amount_base был NULL, в сводки эти строки вошли с нулём — досчитываем их там же,
+        # в той же транзакции, одной дельтой на (категория, валюта, тип, день)
+        deltas: dict[tuple, Decimal] = defaultdict(Decimal)
+        for user_id, category_id, currency_id, is_expense, created, amount_base in filled_rows:
+            if amount_base is None:
+                continue
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=timezone.utc)
+            deltas[(user_id, category_id, currency_id, is_expense, created.astimezone(timezone.utc).date())] += amount_base
+        for (user_id, category_id, currency_id, is_expense, day), amount_base in deltas.items():
+            await orm_apply_rollup(
+                session,
+                user_id=user_id,
+                category_id=category_id,
+                currency_id=currency_id,
+                is_expense=is_expense,
+                amount=Decimal(0),
+                amount_base=amount_base,
+                created=datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc),
+                tx_count=0,
+            )
+        await session.commit()
+        last_id = ids[-1]
+        filled += len(ids)
+
+    if filled:
+        logging.info("Заполнено amount_base у транзакций: %s", filled)
+    return filled
+
+async def update_currency_rates(session: AsyncSession, provider: RateProvider) -> int:
+    quotes = await provider.fetch()
+    # История в снимке должна быть свежей: курсы мог загрузить и другой процесс
+    currencies = await refresh_currencies_if_changed(session)
+
+    rows = []
+    last_rates: dict[int, Decimal] = {}
+    for quote in sorted(quotes, key=lambda quote: quote.valid_from):
+        currency = currencies.by_code.get(quote.code)
+        if currency is None:
+            logging.warning("Курс для неизвестной валюты %s пропущен", quote.code)
+            continue
+        # Курс, который и так действует на эту дату, историю не пополняет: снимок без
+        # valid_from получает время загрузки, и без этой проверки каждый запуск добавлял бы строки
+        previous = last_rates.get(currency.id)
+        if previous is None:
+            previous = currencies.rate_as_of(currency.id, quote.valid_from)
+        last_rates[currency.id] = quote.rate
+        if quote.rate == previous:
+            continue
+        rows.append({"currency_id": currency.id, "valid_from": quote.valid_from, "rate": quote.rate})
+
+    inserted = 0
+    if rows:
+        # Снимок с уже загруженным valid_from (повтор ленты другим процессом) пропускается
+        result = await session.execute(
+            dialect_insert(session, CurrencyRate).values(rows)
+            .on_conflict_do_nothing(index_elements=["currency_id", "valid_from"])
+            .returning(CurrencyRate.id)
+        )
+        inserted = len(result.all())
+
+    # Действующий курс остаётся в currencies.rate_to_base: по нему считаются лимиты и валюта пользователя
+    latest = (
+        select(CurrencyRate.rate)
+        .where(CurrencyRate.currency_id == Currency.id, CurrencyRate.valid_from <= datetime.now(timezone.utc))
+        .order_by(CurrencyRate.valid_from.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    await session.execute(
+        update(Currency)
+        .where(latest != None, Currency.rate_to_base != latest)
+        .values(rate_to_base=latest)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
 
-    await session.commit()
\ No newline at end of file
+    # Снимок в памяти собирается заново и подменяется целиком
+    await refresh_currencies_if_changed(session)
+    if inserted:
+        logging.info("Загружено курсов валют: %s", inserted)
+    return inserted
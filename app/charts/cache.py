@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from app.charts.render import ChartSpec
+
+@dataclass
+class CachedChart:
+    png: bytes | None = None
+    # После первой отправки Telegram возвращает file_id, и картинку можно
+    # пересылать по нему без отрисовки и загрузки
+    file_id: str | None = None
+
+    @property
+    def size(self) -> int:
+        return len(self.png) if self.png else 0
+
+def fingerprint(spec: ChartSpec) -> str:
+    payload = json.dumps(
+        [
+            spec.kind,
+            spec.title,
+            spec.currency,
+            list(spec.labels),
+            [[round(value, 2) for value in series] for series in spec.series],
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ChartCache:
+    def __init__(self, max_entries: int = 512, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[int, str], CachedChart] = OrderedDict()
+        self._bytes = 0
+
+    def get(self, user_id: int, key: str) -> CachedChart | None:
+        entry = self._entries.get((user_id, key))
+        if entry is not None:
+            self._entries.move_to_end((user_id, key))
+        return entry
+
+    def put_png(self, user_id: int, key: str, png: bytes):
+        self._remove((user_id, key))
+        entry = CachedChart(png=png)
+        self._entries[(user_id, key)] = entry
+        self._bytes += entry.size
+        self._evict()
+
+    def set_file_id(self, user_id: int, key: str, file_id: str):
+        entry = self._entries.get((user_id, key))
+        if entry is None:
+            entry = self._entries[(user_id, key)] = CachedChart()
+        # Байты больше не нужны: дальше отправляем по file_id
+        self._bytes -= entry.size
+        entry.png = None
+        entry.file_id = file_id
+        self._entries.move_to_end((user_id, key))
+        self._evict()
+
+    def invalidate_user(self, user_id: int):
+        for cache_key in [cache_key for cache_key in self._entries if cache_key[0] == user_id]:
+            self._remove(cache_key)
+
+    def _remove(self, cache_key: tuple[int, str]):
+        entry = self._entries.pop(cache_key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+
+chart_cache = ChartCache(
+    max_entries=int(os.getenv('CHART_CACHE_ENTRIES', '512')),
+    max_bytes=int(os.getenv('CHART_CACHE_BYTES', str(32 * 1024 * 1024))),
+)
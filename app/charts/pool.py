@@ -0,0 +1,70 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.charts.render import ChartSpec, render_png
+from app.utils.metrics import CHART_PENDING, CHART_REJECTED, CHART_RENDER_SECONDS, registry
+
+class ChartQueueFull(Exception):
+    pass
+
+class ChartRenderer:
+    def __init__(self, workers: int = 2, queue_limit: int = 16, use_processes: bool = True):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.use_processes = use_processes
+        self._executor: Executor | None = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                # spawn: форк процесса с запущенным event loop и потоками aiogram небезопасен
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="chart",
+                )
+        return self._executor
+
+    async def render(self, spec: ChartSpec) -> bytes:
+        # В работе не больше workers графиков, в очереди не больше queue_limit;
+        # всё сверх этого отклоняется сразу, а не копится в памяти
+        if self._pending >= self.workers + self.queue_limit:
+            CHART_REJECTED.inc()
+            raise ChartQueueFull()
+
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), render_png, spec)
+        finally:
+            self._pending -= 1
+            CHART_RENDER_SECONDS.observe(time.perf_counter() - started, kind=spec.kind)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+renderer = ChartRenderer(
+    workers=int(os.getenv('CHART_WORKERS', '2')),
+    queue_limit=int(os.getenv('CHART_QUEUE_LIMIT', '16')),
+    use_processes=os.getenv('CHART_EXECUTOR', 'process') == 'process',
+)
+
+registry.add_collector(lambda: CHART_PENDING.set(renderer.pending))
+
+async def render_chart(spec: ChartSpec) -> bytes:
+    return await renderer.render(spec)
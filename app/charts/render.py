@@ -0,0 +1,95 @@
+import io
+from dataclasses import dataclass
+
+# Только объектный API (Figure + Agg): pyplot держит глобальное состояние
+# и небезопасен при отрисовке из нескольких потоков
+from matplotlib.figure import Figure
+
+@dataclass(frozen=True)
+class ChartSpec:
+    # "pie" — одна серия значений, "bars" — две серии (расходы, доходы)
+    kind: str
+    title: str
+    labels: tuple[str, ...]
+    series: tuple[tuple[float, ...], ...]
+    currency: str = ""
+
+def group_small_slices(labels, values, threshold: float = 0.01, others_label: str = "Прочее"):
+    total = sum(values)
+
+    filtered_labels = []
+    filtered_values = []
+    others_total = 0
+
+    for label, value in zip(labels, values):
+        percent = value / total
+        if percent < threshold:
+            others_total += value
+        else:
+            filtered_labels.append(label)
+            filtered_values.append(value)
+
+    if others_total > 0:
+        filtered_labels.append(others_label)
+        filtered_values.append(others_total)
+
+    return tuple(filtered_labels), tuple(filtered_values)
+
+def _draw_pie(fig: Figure, spec: ChartSpec):
+    ax = fig.subplots()
+    wedges, texts, autotexts = ax.pie(
+        spec.series[0],
+        autopct=lambda pct: f'{pct:.1f}%' if pct >= 1 else '',
+        startangle=90,
+        pctdistance=0.7
+    )
+
+    for text in texts:
+        text.set_text("")
+
+    ax.legend(wedges, spec.labels, title="Категории", loc="center left", bbox_to_anchor=(1, 0.5))
+    ax.set_title(spec.title, fontsize=12)
+
+def _draw_bars(fig: Figure, spec: ChartSpec):
+    expenses, incomes = spec.series
+    x = range(len(spec.labels))
+    bar_width = 0.35
+
+    ax = fig.subplots()
+    ax.bar(
+        [i - bar_width / 2 for i in x],
+        expenses,
+        width=bar_width,
+        label="Расходы",
+        color="salmon"
+    )
+    ax.bar(
+        [i + bar_width / 2 for i in x],
+        incomes,
+        width=bar_width,
+        label="Доходы",
+        color="mediumseagreen"
+    )
+
+    ax.set_xticks(list(x))
+    ax.set_xticklabels(spec.labels, rotation=45, ha='right')
+    ax.set_ylabel(f"Сумма ({spec.currency})")
+    ax.set_title(spec.title)
+    ax.legend()
+    ax.grid(axis='y', linestyle='--', alpha=0.5)
+
+CHART_DRAWERS = {
+    "pie": (_draw_pie, (6, 6)),
+    "bars": (_draw_bars, (10, 6)),
+}
+
+def render_png(spec: ChartSpec) -> bytes:
+    draw, figsize = CHART_DRAWERS[spec.kind]
+
+    fig = Figure(figsize=figsize)
+    draw(fig, spec)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight')
+    return buf.getvalue()
@@ -0,0 +1,32 @@
+import logging
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateColumn
+from app.database.models import Base
+
+def _missing_columns(sync_conn) -> list:
+    inspector = inspect(sync_conn)
+    missing = []
+
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(column for column in table.columns if column.name not in existing)
+
+    return missing
+
+async def apply_columns(engine: AsyncEngine) -> list[str]:
+    # Как и с индексами: create_all не добавляет колонки в существующие таблицы.
+    # Новые колонки должны быть nullable или иметь server_default.
+    async with engine.begin() as conn:
+        missing = await conn.run_sync(_missing_columns)
+
+        added = []
+        for column in missing:
+            ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            logging.info("Добавляю колонку %s.%s", column.table.name, column.name)
+            await conn.exec_driver_sql(f"ALTER TABLE {column.table.name} ADD COLUMN {ddl}")
+            added.append(f"{column.table.name}.{column.name}")
+
+    return added
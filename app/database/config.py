@@ -0,0 +1,125 @@
+import os
+from dataclasses import dataclass, replace
+from typing import Mapping
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+@dataclass(frozen=True)
+class EngineSettings:
+    url: str
+    echo: bool = False
+    pool_size: int | None = None
+    max_overflow: int | None = None
+    pool_timeout: float | None = None
+    pool_recycle: int = -1
+    pool_pre_ping: bool = False
+    statement_timeout_ms: int | None = None
+    # Только для asyncpg; 0 — выключить (нужно за pgbouncer в transaction mode)
+    prepared_statement_cache_size: int | None = None
+
+    @property
+    def backend(self) -> str:
+        return make_url(self.url).get_backend_name()
+
+    def engine_kwargs(self) -> dict:
+        kwargs = {
+            "echo": self.echo,
+            "pool_pre_ping": self.pool_pre_ping,
+            "pool_recycle": self.pool_recycle,
+        }
+        if self.pool_size is not None:
+            kwargs["pool_size"] = self.pool_size
+        if self.max_overflow is not None:
+            kwargs["max_overflow"] = self.max_overflow
+        if self.pool_timeout is not None:
+            kwargs["pool_timeout"] = self.pool_timeout
+
+        connect_args = {}
+        if self.backend == "postgresql":
+            if self.statement_timeout_ms is not None:
+                connect_args["server_settings"] = {"statement_timeout": str(self.statement_timeout_ms)}
+            if self.prepared_statement_cache_size is not None:
+                connect_args["prepared_statement_cache_size"] = self.prepared_statement_cache_size
+        elif self.backend == "sqlite" and self.statement_timeout_ms is not None:
+            # У SQLite нет таймаута запроса, ближайший аналог — ожидание блокировки
+            connect_args["timeout"] = self.statement_timeout_ms / 1000
+        if connect_args:
+            kwargs["connect_args"] = connect_args
+
+        return kwargs
+
+# Значения по умолчанию для прода на Postgres (asyncpg) и для локального SQLite
+DEFAULTS = {
+    "postgresql": {
+        "pool_size": 10,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "statement_timeout_ms": 15000,
+        "prepared_statement_cache_size": 100,
+    },
+    "sqlite": {
+        # Писатель в SQLite всё равно один, большой пул только добавит ожидание блокировок
+        "pool_size": 5,
+        "max_overflow": 0,
+        "pool_timeout": 30,
+        "pool_recycle": -1,
+        "pool_pre_ping": False,
+        "statement_timeout_ms": 5000,
+        "prepared_statement_cache_size": None,
+    },
+}
+
+def _env_int(env: Mapping[str, str], name: str, default: int | None) -> int | None:
+    value = env.get(name)
+    return int(value) if value not in (None, "") else default
+
+def _env_float(env: Mapping[str, str], name: str, default: float | None) -> float | None:
+    value = env.get(name)
+    return float(value) if value not in (None, "") else default
+
+def _env_bool(env: Mapping[str, str], name: str, default: bool) -> bool:
+    value = env.get(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def load_engine_settings(env: Mapping[str, str] = os.environ) -> EngineSettings:
+    url = env.get('DB_URL')
+    if not url:
+        raise RuntimeError("Не задан DB_URL")
+
+    parsed = make_url(url)
+    defaults = DEFAULTS.get(parsed.get_backend_name(), {})
+
+    settings = EngineSettings(
+        url=url,
+        echo=_env_bool(env, 'DB_ECHO', False),
+        pool_size=_env_int(env, 'DB_POOL_SIZE', defaults.get("pool_size")),
+        max_overflow=_env_int(env, 'DB_MAX_OVERFLOW', defaults.get("max_overflow")),
+        pool_timeout=_env_float(env, 'DB_POOL_TIMEOUT', defaults.get("pool_timeout")),
+        pool_recycle=_env_int(env, 'DB_POOL_RECYCLE', defaults.get("pool_recycle", -1)),
+        pool_pre_ping=_env_bool(env, 'DB_POOL_PRE_PING', defaults.get("pool_pre_ping", False)),
+        statement_timeout_ms=_env_int(env, 'DB_STATEMENT_TIMEOUT_MS', defaults.get("statement_timeout_ms")),
+        prepared_statement_cache_size=_env_int(
+            env, 'DB_PREPARED_STATEMENT_CACHE_SIZE', defaults.get("prepared_statement_cache_size")
+        ),
+    )
+
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # Для in-memory базы SQLAlchemy сам выбирает StaticPool, параметры размера он не принимает
+        settings = replace(settings, pool_size=None, max_overflow=None, pool_timeout=None)
+
+    return settings
+
+def pool_stats(engine: AsyncEngine) -> dict:
+    pool = engine.sync_engine.pool
+    stats = {"class": type(pool).__name__}
+
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+
+    return stats
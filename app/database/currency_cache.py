@@ -0,0 +1,108 @@
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from decimal import Decimal
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.models import Currency, CurrencyRate
+
+@dataclass(frozen=True)
+class CurrencyInfo:
+    id: int
+    code: str
+    name: str
+    symbol: str | None
+    rate_to_base: Decimal
+
+    @property
+    def display(self) -> str:
+        return self.symbol or self.code
+
+@dataclass(frozen=True)
+class CurrencySnapshot:
+    version: int = 0
+    # (количество строк, max(updated)) — по нему видно, что таблица менялась
+    stamp: tuple | None = None
+    by_id: dict[int, CurrencyInfo] = field(default_factory=dict)
+    by_code: dict[str, CurrencyInfo] = field(default_factory=dict)
+    # currency_id -> (отсортированные valid_from, курсы) для поиска курса на дату
+    history: dict[int, tuple[list[datetime], list[Decimal]]] = field(default_factory=dict)
+
+    def get(self, currency_id: int) -> CurrencyInfo | None:
+        return self.by_id.get(currency_id)
+
+    def rate(self, currency_id: int) -> Decimal | None:
+        currency = self.by_id.get(currency_id)
+        return currency.rate_to_base if currency else None
+
+    def rate_as_of(self, currency_id: int, moment: datetime) -> Decimal | None:
+        # Без истории — текущий курс; раньше первой записи — самый ранний известный
+        history = self.history.get(currency_id)
+        if not history:
+            return self.rate(currency_id)
+
+        moments, rates = history
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        index = bisect_right(moments, moment)
+        return rates[max(index - 1, 0)]
+
+    def all(self) -> list[CurrencyInfo]:
+        return sorted(self.by_id.values(), key=lambda currency: currency.id)
+
+# Снимок заменяется целиком, поэтому читатели никогда не видят его наполовину обновлённым
+_snapshot = CurrencySnapshot()
+
+def get_currencies() -> CurrencySnapshot:
+    return _snapshot
+
+async def _get_stamp(session: AsyncSession) -> tuple:
+    rates_stamp = select(func.count(CurrencyRate.id)).scalar_subquery()
+    result = await session.execute(select(func.count(Currency.id), func.max(Currency.updated), rates_stamp))
+    return tuple(result.one())
+
+def _as_utc(moment: datetime) -> datetime:
+    # SQLite возвращает время без часового пояса
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+async def load_currencies(session: AsyncSession) -> CurrencySnapshot:
+    global _snapshot
+
+    stamp = await _get_stamp(session)
+    result = await session.execute(select(Currency))
+    currencies = [
+        CurrencyInfo(
+            id=currency.id,
+            code=currency.code,
+            name=currency.name,
+            symbol=currency.symbol,
+            rate_to_base=Decimal(currency.rate_to_base),
+        )
+        for currency in result.scalars()
+    ]
+
+    history: dict[int, tuple[list[datetime], list[Decimal]]] = {}
+    result = await session.execute(
+        select(CurrencyRate.currency_id, CurrencyRate.valid_from, CurrencyRate.rate)
+        .order_by(CurrencyRate.currency_id, CurrencyRate.valid_from)
+    )
+    for currency_id, valid_from, rate in result.all():
+        moments, rates = history.setdefault(currency_id, ([], []))
+        moments.append(_as_utc(valid_from))
+        rates.append(Decimal(rate))
+
+    # Новый снимок собирается целиком и подменяется одним присваиванием
+    _snapshot = CurrencySnapshot(
+        version=_snapshot.version + 1,
+        stamp=stamp,
+        by_id={currency.id: currency for currency in currencies},
+        by_code={currency.code: currency for currency in currencies},
+        history=history,
+    )
+    return _snapshot
+
+async def refresh_currencies_if_changed(session: AsyncSession) -> CurrencySnapshot:
+    # Дешёвая проверка для случая, когда курсы меняет другой процесс
+    if await _get_stamp(session) != _snapshot.stamp:
+        return await load_currencies(session)
+    return _snapshot
@@ -1,17 +1,27 @@
-import os
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from app.database.config import load_engine_settings, pool_stats
 from app.database.models import Base
+from app.database.columns import apply_columns
+from app.database.indexes import apply_indexes
+from app.utils.metrics import instrument_engine
 
 
+engine_settings = load_engine_settings()
+engine = create_async_engine(engine_settings.url, **engine_settings.engine_kwargs())
 
-engine = create_async_engine(os.getenv('DB_URL'), echo=False)
+instrument_engine(engine, lambda: pool_stats(engine))
 
 session_maker = async_sessionmaker(bind = engine, class_= AsyncSession, expire_on_commit=False)
 
 async def create_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await apply_columns(engine)
+    await apply_indexes(engine)
 
 async def drop_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.drop_all)
+
+def get_pool_stats() -> dict:
+    return pool_stats(engine)
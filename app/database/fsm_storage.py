@@ -0,0 +1,86 @@
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Mapping
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database.models import FsmRecord
+from app.database.query_helper import dialect_insert
+
+KEY_COLUMNS = ("bot_id", "chat_id", "user_id", "thread_id", "business_connection_id", "destiny")
+EMPTY_DATA = "{}"
+
+def _key_values(key: StorageKey) -> dict:
+    return {
+        "bot_id": key.bot_id,
+        "chat_id": key.chat_id,
+        "user_id": key.user_id,
+        "thread_id": key.thread_id or 0,
+        "business_connection_id": key.business_connection_id or "",
+        "destiny": key.destiny,
+    }
+
+def _key_filter(key: StorageKey) -> list:
+    return [getattr(FsmRecord, column) == value for column, value in _key_values(key).items()]
+
+class SQLAlchemyStorage(BaseStorage):
+    # FSM в общей базе: несколько процессов бота видят одни и те же незавершённые сценарии.
+    # Брошенные сценарии истекают через ttl и удаляются фоновой задачей.
+    def __init__(self, session_pool: async_sessionmaker, ttl: timedelta | None = timedelta(hours=24)):
+        self.session_pool = session_pool
+        self.ttl = ttl
+
+    def _expires_at(self) -> datetime | None:
+        return datetime.now(timezone.utc) + self.ttl if self.ttl else None
+
+    def _alive(self):
+        return (FsmRecord.expires_at == None) | (FsmRecord.expires_at > datetime.now(timezone.utc))
+
+    async def _upsert(self, session: AsyncSession, key: StorageKey, **values):
+        # Истёкший сценарий не продолжаем: старые данные не должны всплыть в новом
+        await session.execute(delete(FsmRecord).where(*_key_filter(key), ~self._alive()))
+
+        values["expires_at"] = self._expires_at()
+        stmt = dialect_insert(session, FsmRecord).values(**_key_values(key), **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(KEY_COLUMNS),
+            set_={**values, "updated": func.now()},
+        )
+        await session.execute(stmt)
+
+    async def _delete_if_empty(self, session: AsyncSession, key: StorageKey):
+        # После state.clear() строку не храним — таблица растёт только на активных сценариях
+        await session.execute(
+            delete(FsmRecord).where(*_key_filter(key), FsmRecord.state == None, FsmRecord.data == EMPTY_DATA)
+        )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        async with self.session_pool() as session:
+            await self._upsert(session, key, state=state)
+            if state is None:
+                await self._delete_if_empty(session, key)
+            await session.commit()
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        async with self.session_pool() as session:
+            return await session.scalar(select(FsmRecord.state).where(*_key_filter(key), self._alive()))
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        encoded = json.dumps(dict(data), ensure_ascii=False) if data else EMPTY_DATA
+        async with self.session_pool() as session:
+            await self._upsert(session, key, data=encoded)
+            if encoded == EMPTY_DATA:
+                await self._delete_if_empty(session, key)
+            await session.commit()
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        async with self.session_pool() as session:
+            encoded = await session.scalar(select(FsmRecord.data).where(*_key_filter(key), self._alive()))
+        return json.loads(encoded) if encoded else {}
+
+    async def close(self) -> None:
+        # Движком владеет app.database.engine, здесь закрывать нечего
+        pass
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateIndex, DropIndex
+from app.database.models import Base
+
+def _missing_indexes(sync_conn) -> list:
+    inspector = inspect(sync_conn)
+    missing = []
+
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing.extend(index for index in table.indexes if index.name not in existing)
+
+    return missing
+
+async def _invalid_indexes(conn: AsyncConnection) -> list:
+    # Прерванный CREATE INDEX CONCURRENTLY оставляет индекс INVALID: в каталоге он есть,
+    # IF NOT EXISTS его пропускает, а планировщик им не пользуется
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE NOT i.indisvalid AND c.relnamespace = current_schema()::regnamespace"
+    ))
+    invalid = set(result.scalars())
+    return [
+        index
+        for table in Base.metadata.sorted_tables
+        for index in table.indexes
+        if index.name in invalid
+    ]
+
+async def apply_indexes(engine: AsyncEngine) -> list[str]:
+    # create_all не трогает уже существующие таблицы, поэтому индексы,
+    # добавленные в модели позже, докатываются здесь
+    async with engine.connect() as conn:
+        missing = await conn.run_sync(_missing_indexes)
+        invalid = await _invalid_indexes(conn) if engine.dialect.name == "postgresql" else []
+
+    if not missing and not invalid:
+        return []
+
+    created = []
+    # На Postgres строим индекс CONCURRENTLY, чтобы не блокировать запись в большие таблицы.
+    # Такой DDL нельзя выполнять внутри транзакции, отсюда AUTOCOMMIT.
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for index in invalid:
+            logging.warning("Индекс %s невалиден, пересоздаю", index.name)
+            ddl = str(DropIndex(index, if_exists=True).compile(dialect=engine.dialect))
+            await conn.exec_driver_sql(ddl.replace("DROP INDEX", "DROP INDEX CONCURRENTLY", 1))
+
+        for index in missing + invalid:
+            ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+            if engine.dialect.name == "postgresql":
+                ddl = ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+
+            logging.info("Создаю индекс %s", index.name)
+            await conn.exec_driver_sql(ddl)
+            created.append(index.name)
+
+    return created
+
+async def _apply():
+    from app.database.engine import engine
+
+    created = await apply_indexes(engine)
+    print("Созданы индексы:", ", ".join(created) if created else "нет")
+
+if __name__ == '__main__':
+    from dotenv import find_dotenv, load_dotenv
+    load_dotenv(find_dotenv())
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_apply())
@@ -0,0 +1,277 @@
+import asyncio
+import csv
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import AsyncIterator, Iterable
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.currency_cache import get_currencies
+from app.database.models import Category, Limit, Transaction
+from app.database.orm_query import orm_rebuild_limit_spent
+from app.database.query_helper import amount_to_base
+from app.database.rollups import orm_apply_rollup
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX-выгрузка необязательна
+    Workbook = None
+
+IMPORT_COLUMNS = ("date", "amount", "currency", "category", "comment")
+DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%d.%m.%Y", "%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S")
+MAX_REPORTED_ERRORS = 10
+# Предел колонки transactions.amount — Numeric(10, 2)
+MAX_AMOUNT = Decimal("99999999.99")
+
+@dataclass
+class ImportReport:
+    imported: int = 0
+    skipped: int = 0
+    created_categories: list[str] = field(default_factory=list)
+    restored_categories: list[str] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+
+    def add_error(self, line_number: int, message: str):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"строка {line_number}: {message}")
+
+def _parse_date(value: str) -> datetime:
+    value = value.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    raise ValueError(f"неизвестный формат даты '{value}'")
+
+def _parse_amount(value: str) -> tuple[Decimal, bool]:
+    # Как и при ручном вводе: "+" — доход, без знака или с "-" — расход
+    value = value.strip().replace(" ", "").replace(" ", "").replace(",", ".")
+    is_expense = not value.startswith("+")
+    try:
+        amount = abs(Decimal(value.lstrip("+")))
+    except InvalidOperation:
+        raise ValueError(f"некорректная сумма '{value}'")
+    # Decimal принимает "NaN" и "Infinity": первое испортило бы все суммы, второе
+    # упало бы на quantize с InvalidOperation мимо построчной обработки ошибок
+    if not amount.is_finite():
+        raise ValueError(f"некорректная сумма '{value}'")
+    # Граница до округления: огромный порядок не пережил бы quantize, а всё,
+    # что меньше MAX_AMOUNT + 0.005, округляется не выше MAX_AMOUNT
+    if amount >= MAX_AMOUNT + Decimal("0.005"):
+        raise ValueError(f"слишком большая сумма '{value}'")
+    amount = amount.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    if amount == 0:
+        raise ValueError("нулевая сумма")
+    return amount, is_expense
+
+def _reader(lines: Iterable[str]):
+    lines = iter(lines)
+    header = next(lines, "")
+    # Банковские выгрузки часто разделены ";"
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    columns = [column.strip().lower() for column in next(csv.reader([header], delimiter=delimiter))]
+
+    missing = [column for column in IMPORT_COLUMNS[:4] if column not in columns]
+    if missing:
+        raise ValueError("в заголовке нет колонок: " + ", ".join(missing))
+
+    return csv.DictReader(lines, fieldnames=columns, delimiter=delimiter)
+
+async def _flush_batch(session: AsyncSession, batch: list[dict], rollup_deltas: dict):
+    # executemany одним запросом на пачку; сводки — по одной строке на (категория, валюта, тип, день)
+    await session.execute(insert(Transaction), batch)
+    for (category_id, currency_id, is_expense, day), (amount, amount_base, count) in rollup_deltas.items():
+        await orm_apply_rollup(
+            session,
+            user_id=batch[0]["user_id"],
+            category_id=category_id,
+            currency_id=currency_id,
+            is_expense=is_expense,
+            amount=amount,
+            amount_base=amount_base,
+            created=datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc),
+            tx_count=count,
+        )
+    await session.commit()
+
+async def import_transactions_csv(
+    session: AsyncSession,
+    user_id: int,
+    lines: Iterable[str],
+    default_currency_id: int,
+    batch_size: int = 5000
+) -> ImportReport:
+    report = ImportReport()
+    currencies = get_currencies()
+
+    # Все категории пользователя одним запросом, новые создаются по ходу. Удалённые тоже:
+    # строка с такой категорией восстанавливает её, а не заводит дубликат
+    result = await session.execute(
+        select(Category.id, Category.name, Category.is_deleted)
+        .where(Category.user_id == user_id)
+        .order_by(Category.id)
+    )
+    categories = {}
+    deleted_categories = {}
+    for category_id, name, is_deleted in result.all():
+        if is_deleted:
+            deleted_categories[name.strip().lower()] = (category_id, name)
+        else:
+            categories[name.strip().lower()] = category_id
+
+    batch = []
+    rollup_deltas = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+
+    for line_number, row in enumerate(_reader(lines), start=2):
+        try:
+            created = _parse_date(row.get("date") or "")
+            amount, is_expense = _parse_amount(row.get("amount") or "")
+
+            currency_code = (row.get("currency") or "").strip().upper()
+            if currency_code:
+                currency = currencies.by_code.get(currency_code)
+                if currency is None:
+                    raise ValueError(f"неизвестная валюта '{currency_code}'")
+                currency_id = currency.id
+            else:
+                currency_id = default_currency_id
+
+            category_name = (row.get("category") or "").strip()
+            if not category_name:
+                raise ValueError("пустая категория")
+        except ValueError as error:
+            report.add_error(line_number, str(error))
+            continue
+
+        category_id = categories.get(category_name.lower())
+        if category_id is None and category_name.lower() in deleted_categories:
+            # Иначе операции ушли бы в категорию, которую delete_old_categories скоро сотрёт
+            category_id, name = deleted_categories.pop(category_name.lower())
+            categories[category_name.lower()] = category_id
+            await session.execute(
+                update(Category).where(Category.id == category_id).values(is_deleted=False, deleted_at=None)
+            )
+            report.restored_categories.append(name)
+        if category_id is None:
+            category = Category(user_id=user_id, name=category_name[:150])
+            session.add(category)
+            await session.flush()
+            category_id = categories[category_name.lower()] = category.id
+            report.created_categories.append(category_name)
+
+        # Операции из выписки пересчитываются по курсу на их дату
+        amount_base = amount_to_base(amount, currency_id, created)
+        batch.append({
+            "user_id": user_id,
+            "category_id": category_id,
+            "currency_id": currency_id,
+            "amount": amount,
+            "amount_base": amount_base,
+            "is_expense": is_expense,
+            "comment": (row.get("comment") or "").strip(),
+            "created": created,
+        })
+        delta = rollup_deltas[(category_id, currency_id, is_expense, created.date())]
+        delta[0] += amount
+        # Без курса — ноль, backfill_amount_base досчитает сводку вместе со строкой
+        delta[1] += amount_base or 0
+        delta[2] += 1
+
+        if len(batch) >= batch_size:
+            await _flush_batch(session, batch, rollup_deltas)
+            report.imported += len(batch)
+            batch = []
+            rollup_deltas.clear()
+            # Отдаём управление event loop между пачками
+            await asyncio.sleep(0)
+
+    if batch:
+        await _flush_batch(session, batch, rollup_deltas)
+        report.imported += len(batch)
+
+    # Счётчики лимитов пересчитываются один раз в конце, а не на каждой строке
+    if report.imported:
+        limit_ids = (await session.scalars(select(Limit.id).where(Limit.user_id == user_id))).all()
+        if limit_ids:
+            await orm_rebuild_limit_spent(session, limit_ids=list(limit_ids))
+    await session.commit()
+
+    return report
+
+async def iter_export_rows(
+    session: AsyncSession,
+    user_id: int,
+    target_currency_id: int,
+    batch_size: int = 1000
+) -> AsyncIterator[list]:
+    currencies = get_currencies()
+    target = currencies.get(target_currency_id)
+    if target is None or not target.rate_to_base:
+        raise ValueError("Целевая валюта не найдена или некорректна")
+
+    # Заголовок совместим с /import, последняя колонка — сумма в валюте пользователя
+    yield [*IMPORT_COLUMNS, f"amount_{target.code.lower()}"]
+
+    stmt = (
+        select(
+            Transaction.created,
+            Transaction.amount,
+            Transaction.amount_base,
+            Transaction.is_expense,
+            Transaction.currency_id,
+            Category.name,
+            Transaction.comment,
+        )
+        .join(Category, Category.id == Transaction.category_id)
+        .where(Transaction.user_id == user_id)
+        .order_by(Transaction.created, Transaction.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+    # Серверный курсор: в памяти одновременно не больше batch_size строк
+    result = await session.stream(stmt)
+    async for partition in result.partitions():
+        for created, amount, amount_base, is_expense, currency_id, category_name, comment in partition:
+            currency = currencies.get(currency_id)
+            if amount_base is None and currency and currency.rate_to_base:
+                # Строка ещё не заполнена фоновой задачей
+                amount_base = amount * currency.rate_to_base
+            converted = (Decimal(amount_base) / target.rate_to_base).quantize(Decimal("0.01")) if amount_base is not None else ""
+            sign = "" if is_expense else "+"
+
+            yield [
+                created.strftime("%Y-%m-%d %H:%M:%S"),
+                f"{sign}{amount}",
+                currency.code if currency else "",
+                category_name,
+                comment or "",
+                f"{sign}{converted}" if converted != "" else "",
+            ]
+
+async def write_csv(rows: AsyncIterator[list], path: str) -> int:
+    count = -1
+    with open(path, "w", encoding="utf-8-sig", newline="") as file:
+        writer = csv.writer(file)
+        async for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+async def write_xlsx(rows: AsyncIterator[list], path: str) -> int:
+    if Workbook is None:
+        raise RuntimeError("Для выгрузки в XLSX нужен пакет openpyxl")
+
+    # write_only: строки сразу уходят во временный XML, а не копятся в памяти
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Операции")
+    count = -1
+    async for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
+
@@ -1,4 +1,4 @@
-from sqlalchemy import BigInteger, Boolean, DateTime, Float, ForeignKey, Numeric, String, Text, func
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, Float, ForeignKey, Index, Integer, Numeric, String, Text, UniqueConstraint, func, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.ext.asyncio import AsyncAttrs
 
@@ -21,6 +21,16 @@ class User(Base):
 
 class Category(Base):
     __tablename__ = 'categories'
+    __table_args__ = (
+        # Частичный индекс: клавиатуры и отчёты смотрят только на активные категории
+        Index(
+            'ix_categories_user_active', 'user_id',
+            postgresql_where=text('is_deleted = false'),
+            sqlite_where=text('is_deleted = 0'),
+        ),
+        # Штамп категорий пользователя (count, max(updated)) в UserContext читается по индексу
+        Index('ix_categories_user_updated', 'user_id', 'updated'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
@@ -34,12 +44,19 @@ class Category(Base):
 
 class Transaction(Base):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        Index('ix_transactions_user_expense_created', 'user_id', 'is_expense', 'created'),
+        Index('ix_transactions_user_category_created', 'user_id', 'category_id', 'created'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
     category_id: Mapped[int] = mapped_column(ForeignKey('categories.id'))
     currency_id: Mapped[int] = mapped_column(ForeignKey('currencies.id'))
     amount = mapped_column(Numeric(10, 2))
+    # Сумма в базовой валюте по курсу на момент записи; отчёты только суммируют её.
+    # NULL — запись старше колонки, её заполнит фоновая задача
+    amount_base = mapped_column(Numeric(16, 4), nullable=True)
     is_expense = mapped_column(Boolean, default= True)
     comment = mapped_column(Text)
 
@@ -48,6 +65,10 @@ class Transaction(Base):
 
 class Limit(Base):
     __tablename__ = 'limits'
+    __table_args__ = (
+        Index('ix_limits_user_category', 'user_id', 'category_id'),
+        Index('ix_limits_rollover', 'is_updating', 'end_date'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
@@ -55,9 +76,13 @@ class Limit(Base):
     currency_id: Mapped[int] = mapped_column(ForeignKey('currencies.id'))
     limit_amount = mapped_column(Numeric)
     period = mapped_column(Text)
+    # Длина периода в днях для ночного продления лимитов прямо в SQL
+    period_days = mapped_column(Integer, nullable=True)
     is_updating = mapped_column(Boolean, default = False)
     start_date: Mapped[DateTime] = mapped_column(DateTime(timezone=True))
     end_date: Mapped[DateTime] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Сколько потрачено за текущий период в валюте лимита; NULL — ещё не посчитано
+    spent = mapped_column(Numeric(14, 2), nullable=True)
 
     user = relationship('User', back_populates='limits')
     category = relationship('Category', back_populates='limits')
@@ -65,6 +90,9 @@ class Limit(Base):
 
 class Setting(Base):
     __tablename__ = 'settings'
+    __table_args__ = (
+        Index('ix_settings_user_id', 'user_id'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
@@ -84,3 +112,111 @@ class Currency(Base):
     symbol: Mapped[str] = mapped_column(String(5), nullable=True)
 
     #limits = relationship('Limit', back_populates='currency', cascade="all, delete-orphan")
+
+
+class DailyRollup(Base):
+    __tablename__ = 'transaction_daily_rollups'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'category_id', 'currency_id', 'is_expense', 'day'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
+    category_id: Mapped[int] = mapped_column(ForeignKey('categories.id'))
+    currency_id: Mapped[int] = mapped_column(ForeignKey('currencies.id'))
+    is_expense = mapped_column(Boolean, nullable=False)
+    day = mapped_column(Date, nullable=False)
+    amount = mapped_column(Numeric(14, 2), nullable=False, default=0)
+    # NULL — сводка построена до появления колонки, при старте она пересобирается
+    amount_base = mapped_column(Numeric(18, 4), nullable=True)
+    tx_count = mapped_column(Integer, nullable=False, default=0)
+
+
+class MonthlyRollup(Base):
+    __tablename__ = 'transaction_monthly_rollups'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'category_id', 'currency_id', 'is_expense', 'month'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
+    category_id: Mapped[int] = mapped_column(ForeignKey('categories.id'))
+    currency_id: Mapped[int] = mapped_column(ForeignKey('currencies.id'))
+    is_expense = mapped_column(Boolean, nullable=False)
+    # Первое число месяца
+    month = mapped_column(Date, nullable=False)
+    amount = mapped_column(Numeric(14, 2), nullable=False, default=0)
+    # NULL — сводка построена до появления колонки, при старте она пересобирается
+    amount_base = mapped_column(Numeric(18, 4), nullable=True)
+    tx_count = mapped_column(Integer, nullable=False, default=0)
+
+
+class FsmRecord(Base):
+    # Состояния и данные FSM aiogram; общие для всех процессов бота
+    __tablename__ = 'fsm_states'
+    __table_args__ = (
+        UniqueConstraint('bot_id', 'chat_id', 'user_id', 'thread_id', 'business_connection_id', 'destiny',
+                         name='uq_fsm_states_key'),
+        Index('ix_fsm_states_expires_at', 'expires_at'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    bot_id = mapped_column(BigInteger, nullable=False)
+    chat_id = mapped_column(BigInteger, nullable=False)
+    user_id = mapped_column(BigInteger, nullable=False)
+    # Пустые значения ключа хранятся как 0 и '', иначе NULL обходит уникальность
+    thread_id = mapped_column(BigInteger, nullable=False, default=0)
+    business_connection_id = mapped_column(String(64), nullable=False, default='')
+    destiny = mapped_column(String(64), nullable=False, default='default')
+    state = mapped_column(String(255), nullable=True)
+    # JSON строкой: пустые данные сравниваются с '{}' одинаково в Postgres и SQLite
+    data = mapped_column(Text, nullable=False, default='{}')
+    expires_at = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class OutboundMessage(Base):
+    # Очередь исходящих рассылок (уведомления о лимитах, дайджесты); строка удаляется после отправки
+    __tablename__ = 'outbound_messages'
+    __table_args__ = (
+        Index('ix_outbound_messages_due', 'status', 'next_attempt_at'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    chat_id = mapped_column(BigInteger, nullable=False)
+    # Параметры sendMessage строкой JSON: text, parse_mode, reply_markup...
+    payload = mapped_column(Text, nullable=False)
+    # pending — ждёт отправки, failed — Telegram отказал окончательно
+    status = mapped_column(String(16), nullable=False, default='pending')
+    attempts = mapped_column(Integer, nullable=False, default=0)
+    # Раньше этого времени строку не трогаем: ожидание retry_after, бэкофф или занята другим процессом
+    next_attempt_at = mapped_column(DateTime(timezone=True), nullable=False, default=func.now())
+    last_error = mapped_column(Text, nullable=True)
+
+
+class LimitAlert(Base):
+    # Отправленные уведомления о лимитах: по одному на порог за период лимита
+    __tablename__ = 'limit_alerts'
+    __table_args__ = (
+        UniqueConstraint('limit_id', 'period_start', 'threshold', name='uq_limit_alerts_period'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    limit_id: Mapped[int] = mapped_column(ForeignKey('limits.id', ondelete='CASCADE'))
+    # Копия limits.start_date на момент уведомления; после продления лимита период новый
+    period_start = mapped_column(DateTime(timezone=True), nullable=False)
+    # Процент лимита: 80 или 100
+    threshold = mapped_column(Integer, nullable=False)
+
+
+class CurrencyRate(Base):
+    # История курсов к базовой валюте; действующий курс на момент t — последняя строка с valid_from <= t
+    __tablename__ = 'currency_rates'
+    __table_args__ = (
+        # Уникальность заодно служит индексом для поиска курса на дату
+        UniqueConstraint('currency_id', 'valid_from', name='uq_currency_rates_valid_from'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    currency_id: Mapped[int] = mapped_column(ForeignKey('currencies.id'))
+    valid_from = mapped_column(DateTime(timezone=True), nullable=False)
+    rate = mapped_column(Numeric(14, 6), nullable=False)
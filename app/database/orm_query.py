@@ -1,9 +1,11 @@
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from decimal import ROUND_HALF_UP, Decimal
-from sqlalchemy import extract, func, select, update, delete, desc
+from sqlalchemy import Select, and_, case, func, or_, select, update, delete, desc
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database.models import Limit, Transaction, User, Category, Setting, Currency
-from app.database.query_helper import convert_transactions_to_currency
+from app.database.models import Limit, LimitAlert, MonthlyRollup, Transaction, User, Category, Setting, Currency
+from app.database.currency_cache import CurrencyInfo, get_currencies, load_currencies
+from app.database.query_helper import amount_to_base, dialect_insert, period_to_days, transaction_amount_base
+from app.database.rollups import orm_apply_rollup
 from app.utils.constants import DEFAULT_CATEGORIES, CURRENCIES
 
 async def orm_add_default_categories(session: AsyncSession, user_id: int):
@@ -16,6 +18,9 @@ async def orm_add_default_categories(session: AsyncSession, user_id: int):
         session.add(category)
 
 async def orm_add_default_currencies(session: AsyncSession):
+    if all(cur["code"] in get_currencies().by_code for cur in CURRENCIES):
+        return
+
     for cur in CURRENCIES:
         result = await session.execute(
             select(Currency).where(Currency.code == cur["code"])
@@ -32,12 +37,10 @@ async def orm_add_default_currencies(session: AsyncSession):
             session.add(currency)
 
     await session.commit()
+    await load_currencies(session)
 
 async def orm_add_default_settings(session: AsyncSession, user_id: int):
-    result = await session.execute(
-        select(Currency).where(Currency.code == "RUB")
-    )
-    rub_currency = result.scalar_one_or_none()
+    rub_currency = get_currencies().by_code.get("RUB")
      
     default_setting = Setting(
         user_id=user_id,
@@ -81,11 +84,17 @@ async def orm_update_category(session: AsyncSession, category_id: int, category_
         category.name = category_name
         await session.commit()
 
-async def orm_get_categories(session: AsyncSession):
-    return await session.scalars(select(Category))
+async def orm_get_user_categories(session: AsyncSession, user_id: int, deleted: bool = False) -> list[Category]:
+    # Фильтр по пользователю и is_deleted в SQL — активные идут по частичному индексу
+    result = await session.scalars(
+        select(Category)
+        .where(Category.user_id == user_id, Category.is_deleted == deleted)
+        .order_by(Category.id)
+    )
+    return result.all()
 
-async def orm_get_currencies(session: AsyncSession):
-    return await session.scalars(select(Currency))
+async def orm_get_currencies(session: AsyncSession) -> list[CurrencyInfo]:
+    return get_currencies().all()
 
 async def set_user_currency(session: AsyncSession, currency_id: int, user_id: int):
 
@@ -99,151 +108,249 @@ async def set_user_currency(session: AsyncSession, currency_id: int, user_id: in
 async def orm_get_category_by_id(session: AsyncSession, category_id: int) -> Category:
     return await session.get(Category, category_id)
 
-async def orm_get_currency_by_id(session: AsyncSession, currency_id: int) -> Currency:
-    return await session.get(Currency, currency_id)
+async def orm_get_currency_by_id(session: AsyncSession, currency_id: int) -> CurrencyInfo:
+    return get_currencies().get(currency_id)
 
 async def orm_get_user_by_tg_id(session: AsyncSession, tg_id: int) -> User:
     stmt = select(User).where(User.tg_id == tg_id)
     return await session.scalar(stmt)
 
 async def orm_make_transaction(session: AsyncSession, data: dict):
+    created = datetime.now(timezone.utc)
+    amount = Decimal(str(data["amount"])).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    amount_base = amount_to_base(amount, data["currency_id"], created)
 
     new_transaction = Transaction(
         user_id = data["user_id"],
         category_id = data["category_id"],
         currency_id = data["currency_id"],
-        amount = float(data["amount"]),
+        amount = amount,
+        amount_base = amount_base,
         is_expense = data["is_expense"],
-        comment = data["comment"]
+        comment = data["comment"],
+        created = created
     )
     session.add(new_transaction)
-    await session.commit()
 
-async def orm_all_expenses(session: AsyncSession, user_id: int):
-    user_currency_result = await session.execute(
-        select(Setting.currency_id).where(Setting.user_id == user_id)
-    )
-    user_currency_id = user_currency_result.scalar()
+    if data["is_expense"] and amount_base is not None:
+        await _add_to_limit_spent(session, data, amount_base, created)
 
-    if user_currency_id is None:
-        raise ValueError("Не установлена валюта пользователя")
+    # Сводки обновляются в той же транзакции, что и сама запись
+    await orm_apply_rollup(
+        session,
+        user_id=data["user_id"],
+        category_id=data["category_id"],
+        currency_id=data["currency_id"],
+        is_expense=data["is_expense"],
+        amount=amount,
+        # Без курса в сводку идёт ноль; backfill_amount_base досчитает её вместе со строкой
+        amount_base=amount_base or Decimal(0),
+        created=created,
+    )
+    await session.commit()
 
-    currencies_result = await session.execute(select(Currency))
-    currencies = {c.id: c.rate_to_base for c in currencies_result.scalars()}
-    user_rate = currencies.get(user_currency_id)
+def _limit_rate():
+    return (
+        select(Currency.rate_to_base)
+        .where(Currency.id == Limit.currency_id)
+        .scalar_subquery()
+    )
 
-    if user_rate is None or user_rate == 0:
-        raise ValueError("Нет курса для валюты пользователя")
+async def _add_to_limit_spent(session: AsyncSession, data: dict, amount_base: Decimal, created: datetime):
+    # Счётчик обновляется одним UPDATE в той же транзакции, что и запись траты.
+    # NULL (ещё не посчитанный счётчик) не трогаем — его восстановит orm_rebuild_limit_spent.
+    await session.execute(
+        update(Limit)
+        .where(
+            Limit.user_id == data["user_id"],
+            Limit.category_id == data["category_id"],
+            Limit.spent.isnot(None),
+            Limit.start_date <= created,
+            (Limit.end_date == None) | (Limit.end_date >= created)
+        )
+        .values(spent=Limit.spent + amount_base / _limit_rate())
+        .execution_options(synchronize_session=False)
+    )
 
-    result = await session.execute(
-        select(Category.name, Transaction.amount, Transaction.currency_id)
-        .join(Transaction)
+async def orm_rebuild_limit_spent(
+    session: AsyncSession,
+    limit_ids: list[int] | None = None,
+    only_missing: bool = False
+):
+    # Пересчёт счётчиков по истории транзакций одним UPDATE с коррелированным подзапросом
+    spent_in_base = (
+        select(func.coalesce(func.sum(transaction_amount_base()), 0))
         .where(
-            Transaction.user_id == user_id,
+            Transaction.user_id == Limit.user_id,
+            Transaction.category_id == Limit.category_id,
             Transaction.is_expense == True,
-            Category.is_deleted == False
+            Transaction.created >= Limit.start_date,
+            (Limit.end_date == None) | (Transaction.created <= Limit.end_date)
         )
+        .scalar_subquery()
     )
 
-    totals_by_category = {}
+    stmt = update(Limit).values(spent=spent_in_base / _limit_rate())
+    if limit_ids is not None:
+        stmt = stmt.where(Limit.id.in_(limit_ids))
+    if only_missing:
+        stmt = stmt.where(Limit.spent == None)
 
-    for category_name, amount, currency_id in result.all():
-        tx_rate = currencies.get(currency_id)
-        if tx_rate is None or tx_rate == 0:
-            continue
+    await session.execute(stmt.execution_options(synchronize_session=False))
 
-        amount_in_user_currency = amount * (tx_rate / user_rate)
-
-        totals_by_category[category_name] = totals_by_category.get(category_name, 0) + amount_in_user_currency
-
-    return [(name, round(total, 2)) for name, total in totals_by_category.items()]
-
-async def orm_all_income(session: AsyncSession, user_id: int):
-    user_currency_result = await session.execute(
-        select(Setting.currency_id).where(Setting.user_id == user_id)
+async def orm_ensure_limit_spent(session: AsyncSession):
+    # Лимиты, созданные до появления счётчика: досчитываем end_date и spent
+    result = await session.execute(
+        select(Limit).where(Limit.spent == None, Limit.end_date == None)
     )
-    user_currency_id = user_currency_result.scalar()
-
-    if user_currency_id is None:
-        raise ValueError("Не установлена валюта пользователя")
+    for limit in result.scalars():
+        days = period_to_days(limit.period)
+        if days and limit.start_date:
+            limit.end_date = limit.start_date + timedelta(days=days)
+    await session.flush()
 
-    currencies_result = await session.execute(select(Currency))
-    currencies = {c.id: c.rate_to_base for c in currencies_result.scalars()}
-    user_rate = currencies.get(user_currency_id)
+    await orm_rebuild_limit_spent(session, only_missing=True)
+    await session.commit()
 
-    if user_rate is None or user_rate == 0:
+async def _get_user_rate(session: AsyncSession, user_id: int, currency_id: int | None = None) -> Decimal:
+    # currency_id уже известен из контекста пользователя — тогда обходимся без запроса
+    if currency_id is not None:
+        user_currency = get_currencies().get(currency_id)
+    else:
+        user_currency = await orm_get_user_currency(session, user_id)
+    if user_currency is None:
+        raise ValueError("Не установлена валюта пользователя")
+    if not user_currency.rate_to_base:
         raise ValueError("Нет курса для валюты пользователя")
+    return user_currency.rate_to_base
 
-    result = await session.execute(
-        select(Category.name, Transaction.amount, Transaction.currency_id)
-        .join(Transaction)
-        .where(
-            Transaction.user_id == user_id,
-            Transaction.is_expense == False,
-            Category.is_deleted == False
+def _rollup_totals(*group_columns):
+    # Суммы по сводкам в базовой валюте: пересчёт курсов сделан при записи, здесь только SUM
+    return (
+        select(
+            *group_columns,
+            func.sum(MonthlyRollup.amount_base).label("total")
         )
+        .join(Category, MonthlyRollup.category_id == Category.id)
+        .group_by(*group_columns)
     )
 
-    totals_by_category = {}
-
-    for category_name, amount, currency_id in result.all():
-        tx_rate = currencies.get(currency_id)
-        if tx_rate is None or tx_rate == 0:
-            continue
+def _convert_totals(rows, user_rate: Decimal) -> dict:
+    # Одно деление на группу — перевод из базовой валюты в валюту пользователя
+    return {
+        tuple(key): round(Decimal(total) / user_rate, 2)
+        for *key, total in rows
+        if total is not None
+    }
+
+async def orm_get_category_totals(
+    session: AsyncSession,
+    user_id: int,
+    is_expense: bool,
+    since: date | None = None,
+    currency_id: int | None = None
+):
+    user_rate = await _get_user_rate(session, user_id, currency_id)
+
+    stmt = _rollup_totals(Category.name).where(
+        MonthlyRollup.user_id == user_id,
+        MonthlyRollup.is_expense == is_expense,
+        Category.is_deleted == False
+    )
+    if since is not None:
+        stmt = stmt.where(MonthlyRollup.month >= since)
 
-        amount_in_user_currency = amount * (tx_rate / user_rate)
+    result = await session.execute(stmt)
+    totals = _convert_totals(result.all(), user_rate)
+    return [(name, total) for (name,), total in totals.items()]
 
-        totals_by_category[category_name] = totals_by_category.get(category_name, 0) + amount_in_user_currency
+def _current_month_start() -> date:
+    now = datetime.now(timezone.utc)
+    return date(now.year, now.month, 1)
 
-    return [(name, round(total, 2)) for name, total in totals_by_category.items()]
+async def orm_all_expenses(session: AsyncSession, user_id: int, currency_id: int | None = None):
+    return await orm_get_category_totals(session, user_id, is_expense=True, currency_id=currency_id)
 
-async def orm_get_total_amount_by_category(session: AsyncSession, user_id: int, category_id: int):
-    user_currency_result = await session.execute(
-        select(Setting.currency_id).where(Setting.user_id == user_id)
-    )
-    user_currency_id = user_currency_result.scalar()
+async def orm_all_income(session: AsyncSession, user_id: int, currency_id: int | None = None):
+    return await orm_get_category_totals(session, user_id, is_expense=False, currency_id=currency_id)
 
-    currencies_result = await session.execute(select(Currency.id, Currency.rate_to_base))
-    currencies = {row.id: row.rate_to_base for row in currencies_result.all()}
-
-    user_currency_rate = currencies.get(user_currency_id)
-    if user_currency_rate is None or user_currency_rate == 0:
-        raise ValueError("Некорректный курс валюты пользователя")
+async def orm_get_total_amount_by_category(
+    session: AsyncSession,
+    user_id: int,
+    category_id: int,
+    currency_id: int | None = None
+):
+    user_rate = await _get_user_rate(session, user_id, currency_id)
 
+    # Разбивка по валютам нужна для карточки категории, итог — сумма amount_base
     result = await session.execute(
-        select(Transaction.amount, Transaction.currency_id)
+        select(MonthlyRollup.currency_id, func.sum(MonthlyRollup.amount), func.sum(MonthlyRollup.amount_base))
         .where(
-            Transaction.user_id == user_id,
-            Transaction.category_id == category_id,
-            Transaction.is_expense == True
+            MonthlyRollup.user_id == user_id,
+            MonthlyRollup.category_id == category_id,
+            MonthlyRollup.is_expense == True
         )
+        .group_by(MonthlyRollup.currency_id)
     )
-    transactions = result.all()
 
     totals_by_currency = {}
-    total_in_user_currency = Decimal(0.0)
+    total_base = Decimal(0)
+
+    for currency_id, amount, amount_base in result.all():
+        totals_by_currency[currency_id] = Decimal(amount)
+        total_base += Decimal(amount_base or 0)
+
+    return total_base / user_rate, totals_by_currency
+
+async def orm_get_transactions_page(
+    session: AsyncSession,
+    user_id: int,
+    category_id: int,
+    limit: int = 5,
+    before_id: int | None = None,
+    after_id: int | None = None
+) -> tuple[list[Transaction], bool]:
+    # Keyset-пагинация по (created, id) без OFFSET: курсор — id крайней транзакции
+    # страницы, его created берётся по первичному ключу. Страница всегда от новых к старым,
+    # второй элемент — есть ли ещё записи дальше в направлении листания.
+    stmt = select(Transaction).where(
+        Transaction.user_id == user_id,
+        Transaction.category_id == category_id
+    )
 
-    for amount, currency_id in transactions:
-        totals_by_currency[currency_id] = totals_by_currency.get(currency_id, Decimal(0.0)) + amount
+    cursor_id = before_id if before_id is not None else after_id
+    if cursor_id is not None:
+        cursor_created = select(Transaction.created).where(Transaction.id == cursor_id).scalar_subquery()
+        if before_id is not None:
+            # Лишнее условие created <= курсор даёт диапазон по индексу (user_id, category_id, created)
+            stmt = stmt.where(
+                Transaction.created <= cursor_created,
+                or_(
+                    Transaction.created < cursor_created,
+                    and_(Transaction.created == cursor_created, Transaction.id < cursor_id)
+                )
+            )
+        else:
+            stmt = stmt.where(
+                Transaction.created >= cursor_created,
+                or_(
+                    Transaction.created > cursor_created,
+                    and_(Transaction.created == cursor_created, Transaction.id > cursor_id)
+                )
+            )
 
-        tx_rate = currencies.get(currency_id)
-        if tx_rate and user_currency_rate:
-            converted = amount * (tx_rate / user_currency_rate)
-            total_in_user_currency += converted
+    if after_id is not None:
+        stmt = stmt.order_by(Transaction.created, Transaction.id)
+    else:
+        stmt = stmt.order_by(desc(Transaction.created), desc(Transaction.id))
 
-    return total_in_user_currency, totals_by_currency
+    transactions = list((await session.scalars(stmt.limit(limit + 1))).all())
+    has_more = len(transactions) > limit
+    transactions = transactions[:limit]
+    if after_id is not None:
+        transactions.reverse()
 
-async def orm_get_last_transactions(session: AsyncSession, user_id: int, category_id: int, limit: int = 5):
-    result = await session.execute(
-        select(Transaction)
-        .where(
-            Transaction.user_id == user_id,
-            Transaction.category_id == category_id
-        )
-        .order_by(desc(Transaction.created))
-        .limit(limit)
-    )
-    return result.scalars().all()
+    return transactions, has_more
 
 async def orm_set_category_limit(session: AsyncSession, data: dict):
     await session.execute(
@@ -253,6 +360,9 @@ async def orm_set_category_limit(session: AsyncSession, data: dict):
         )
     )
 
+    days = period_to_days(data["period"])
+    end_date = data["start_date"] + timedelta(days=days) if days else None
+
     new_limit = Limit(
         user_id=data["user_id"],
         category_id=data["category_id"],
@@ -260,7 +370,10 @@ async def orm_set_category_limit(session: AsyncSession, data: dict):
         period=data["period"],
         currency_id=data["currency_id"],
         start_date=data["start_date"],
-        is_updating=data["is_updating"]
+        end_date=end_date,
+        period_days=days,
+        is_updating=data["is_updating"],
+        spent=0
     )
     session.add(new_limit)
 
@@ -275,92 +388,16 @@ async def orm_get_category_limit(session: AsyncSession, user_id: int, category_i
     )
     return result.scalar_one_or_none()
 
-async def orm_get_monthly_expenses_by_category(session: AsyncSession, user_id: int):
-    now = datetime.now()
-    start_of_month = datetime(now.year, now.month, 1)
-
-    user_currency_result = await session.execute(
-        select(Setting.currency_id).where(Setting.user_id == user_id)
-    )
-    user_currency_id = user_currency_result.scalar()
-    if user_currency_id is None:
-        raise ValueError("Не установлена валюта пользователя")
-
-    currencies_result = await session.execute(select(Currency))
-    currencies = {c.id: c.rate_to_base for c in currencies_result.scalars()}
-    user_rate = currencies.get(user_currency_id)
-    if user_rate is None or user_rate == 0:
-        raise ValueError("Нет курса для валюты пользователя")
-
-    stmt = (
-        select(Category.name, Transaction.amount, Transaction.currency_id)
-        .join(Transaction.category)
-        .where(
-            Transaction.user_id == user_id,
-            Transaction.is_expense == True,
-            Transaction.created >= start_of_month,
-            extract("month", Transaction.created) == now.month,
-            Category.is_deleted == False
-        )
-    )
-
-    result = await session.execute(stmt)
-
-    totals_by_category = {}
-
-    for category_name, amount, currency_id in result.all():
-        tx_rate = currencies.get(currency_id)
-        if tx_rate is None or tx_rate == 0:
-            continue
-
-        amount_in_user_currency = amount * (user_rate / tx_rate)
-        totals_by_category[category_name] = totals_by_category.get(category_name, 0) + amount_in_user_currency
-
-    return [(name, round(total, 2)) for name, total in totals_by_category.items()]
-
-async def orm_get_monthly_income_by_category(session: AsyncSession, user_id: int):
-    now = datetime.now()
-    start_of_month = datetime(now.year, now.month, 1)
-
-    user_currency_result = await session.execute(
-        select(Setting.currency_id).where(Setting.user_id == user_id)
+async def orm_get_monthly_expenses_by_category(session: AsyncSession, user_id: int, currency_id: int | None = None):
+    return await orm_get_category_totals(
+        session, user_id, is_expense=True, since=_current_month_start(), currency_id=currency_id
     )
-    user_currency_id = user_currency_result.scalar()
-    if user_currency_id is None:
-        raise ValueError("Не установлена валюта пользователя")
-
-    currencies_result = await session.execute(select(Currency))
-    currencies = {c.id: c.rate_to_base for c in currencies_result.scalars()}
-    user_rate = currencies.get(user_currency_id)
-    if user_rate is None or user_rate == 0:
-        raise ValueError("Нет курса для валюты пользователя")
 
-    stmt = (
-        select(Category.name, Transaction.amount, Transaction.currency_id)
-        .join(Transaction.category)
-        .where(
-            Transaction.user_id == user_id,
-            Transaction.is_expense == False,
-            Transaction.created >= start_of_month,
-            extract("month", Transaction.created) == now.month,
-            Category.is_deleted == False
-        )
+async def orm_get_monthly_income_by_category(session: AsyncSession, user_id: int, currency_id: int | None = None):
+    return await orm_get_category_totals(
+        session, user_id, is_expense=False, since=_current_month_start(), currency_id=currency_id
     )
 
-    result = await session.execute(stmt)
-
-    totals_by_category = {}
-
-    for category_name, amount, currency_id in result.all():
-        tx_rate = currencies.get(currency_id)
-        if tx_rate is None or tx_rate == 0:
-            continue
-
-        amount_in_user_currency = amount * (user_rate / tx_rate)
-        totals_by_category[category_name] = totals_by_category.get(category_name, 0) + amount_in_user_currency
-
-    return [(name, round(total, 2)) for name, total in totals_by_category.items()]
-
 async def check_limit(session: AsyncSession, user_id: int, category_id: int) -> tuple[bool, float | None]:
     stmt_limit = select(Limit).where(
         Limit.user_id == user_id,
@@ -372,110 +409,82 @@ async def check_limit(session: AsyncSession, user_id: int, category_id: int) ->
     if not limit or not limit.limit_amount or not limit.currency_id:
         return False, None
 
-    start_date = limit.start_date
-    if limit.period.endswith("d"):
-        try:
-            days = int(limit.period[:-1])
-            end_date = start_date + timedelta(days=days)
-        except ValueError:
-            return False, None
-    elif limit.period == "custom":
-        end_date = limit.end_date
-        if not end_date:
-            return False, None
-    else:
-        return False, None
-
-    stmt = select(Transaction.amount, Transaction.currency_id).where(
-        Transaction.user_id == user_id,
-        Transaction.category_id == category_id,
-        Transaction.is_expense == True,
-        Transaction.created >= start_date,
-        Transaction.created <= end_date
-    )
-    result = await session.execute(stmt)
-    transactions = result.all()
+    if limit.spent is None:
+        await orm_rebuild_limit_spent(session, limit_ids=[limit.id])
+        await session.commit()
+        await session.refresh(limit)
 
-    if not transactions:
+    total_spent = Decimal(limit.spent or 0)
+    if not total_spent:
         return False, 0.0
 
-    total_spent = await convert_transactions_to_currency(
-        session=session,
-        transactions=transactions,
-        target_currency_id=limit.currency_id
-    )
-
     percent_used = (total_spent / Decimal(limit.limit_amount)) * Decimal("100")
-    exceeded = total_spent > Decimal(limit.limit_amount)
+    # Тот же оператор, что в limit_alert_threshold: иначе при тратах ровно в лимит
+    # хендлер показал бы порог 80, а отметка легла бы на порог 100
+    exceeded = total_spent >= Decimal(limit.limit_amount)
 
     return exceeded, float(percent_used)
 
-async def orm_get_income_expense_by_months(session, user_id: int, months: int = 6):
-    today = datetime.now()
-    start_date = (today - timedelta(days=months * 30)).replace(day=1)
-    end_date = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+# Доля лимита, с которой начинаем предупреждать
+LIMIT_ALERT_SHARE = Decimal("0.8")
 
-    # Получаем валюту пользователя
-    user_currency_result = await session.execute(
-        select(Setting.currency_id).where(Setting.user_id == user_id)
+def limit_alert_threshold():
+    # Потрачено не меньше лимита — порог 100, иначе 80. Сравнение без деления:
+    # в SQLite целые Numeric делились бы нацело
+    return case((Limit.spent >= Limit.limit_amount, 100), else_=80)
+
+def limit_alert_reached():
+    return and_(
+        Limit.spent != None,
+        Limit.limit_amount > 0,
+        Limit.spent >= Limit.limit_amount * LIMIT_ALERT_SHARE,
     )
-    user_currency_id = user_currency_result.scalar_one_or_none()
 
-    if not user_currency_id:
-        raise ValueError("Не установлена валюта пользователя")
+def insert_limit_alerts(session: AsyncSession, candidates: Select):
+    # candidates: (limit_id, start_date, threshold). period_start копируется из limits
+    # в самом INSERT ... SELECT, поэтому сравнение с limits.start_date всегда точное
+    return (
+        dialect_insert(session, LimitAlert)
+        .from_select(["limit_id", "period_start", "threshold"], candidates)
+        .on_conflict_do_nothing(index_elements=["limit_id", "period_start", "threshold"])
+    )
 
-    # Получаем курсы валют
-    currencies_result = await session.execute(select(Currency.id, Currency.rate_to_base))
-    currencies = {row.id: row.rate_to_base for row in currencies_result.all()}
+async def orm_mark_limit_alerted(session: AsyncSession, user_id: int, category_id: int):
+    # Предупреждение уже показано при вводе траты — фоновая рассылка не повторит его в этом периоде
+    await session.execute(insert_limit_alerts(
+        session,
+        select(Limit.id, Limit.start_date, limit_alert_threshold())
+        .where(Limit.user_id == user_id, Limit.category_id == category_id, limit_alert_reached())
+    ))
+    await session.commit()
 
-    user_rate = currencies.get(user_currency_id)
-    if not user_rate or user_rate == 0:
-        raise ValueError("Нет курса для валюты пользователя")
+async def orm_get_income_expense_by_months(session, user_id: int, months: int = 6, currency_id: int | None = None):
+    today = datetime.now(timezone.utc).date()
+    start_date = (today - timedelta(days=months * 30)).replace(day=1)
+    end_date = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+    user_rate = await _get_user_rate(session, user_id, currency_id)
 
-    # Получаем данные по транзакциям
     stmt = (
-        select(
-            func.to_char(Transaction.created, 'YYYY-MM').label('month'),
-            Transaction.is_expense,
-            Category.name.label('category'),
-            Transaction.amount,
-            Transaction.currency_id
-        )
-        .join(Category, Transaction.category_id == Category.id)
+        _rollup_totals(MonthlyRollup.month, MonthlyRollup.is_expense, Category.name)
         .where(
-            Transaction.user_id == user_id,
-            Transaction.created >= start_date,
-            Transaction.created < end_date
+            MonthlyRollup.user_id == user_id,
+            MonthlyRollup.month >= start_date,
+            MonthlyRollup.month < end_date
         )
     )
 
     result = await session.execute(stmt)
-    rows = result.all()
-
-    # Агрегация с учётом валют
-    summary = {}
-
-    for month, is_expense, category, amount, currency_id in rows:
-        tx_rate = currencies.get(currency_id)
-        if not tx_rate or tx_rate == 0:
-            continue
-
-        # Конвертация в валюту пользователя
-        converted_amount = Decimal(amount) * Decimal(user_rate) / Decimal(tx_rate)
-
-        key = (month, is_expense, category)
-        summary[key] = summary.get(key, Decimal(0)) + converted_amount
+    totals = _convert_totals(result.all(), user_rate)
 
     # Возврат как список кортежей для совместимости
     return [
-        (month, is_expense, category, round(total, 2))
-        for (month, is_expense, category), total in sorted(summary.items())
+        (month.strftime('%Y-%m'), is_expense, category, total)
+        for (month, is_expense, category), total in sorted(totals.items())
     ]
 
-async def orm_get_user_currency(session, user_id: int) -> Currency:
-    result = await session.execute(
-        select(Currency)
-        .join(Setting, Setting.currency_id == Currency.id)
-        .where(Setting.user_id == user_id)
+async def orm_get_user_currency(session, user_id: int) -> CurrencyInfo | None:
+    currency_id = await session.scalar(
+        select(Setting.currency_id).where(Setting.user_id == user_id)
     )
-    return result.scalar_one_or_none()
\ No newline at end of file
+    return get_currencies().get(currency_id)
\ No newline at end of file
@@ -1,33 +1,60 @@
+from datetime import datetime
 from decimal import Decimal
-from sqlalchemy import select
-from app.database.models import Currency
+from sqlalchemy import Date, Integer, cast, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from app.database.currency_cache import get_currencies
+from app.database.models import Currency, Transaction
 from sqlalchemy.ext.asyncio import AsyncSession
 
-async def convert_transactions_to_currency(
-    session: AsyncSession,
-    transactions: list[tuple[Decimal, int]],
-    target_currency_id: int
-) -> Decimal:
-
-    result = await session.execute(select(Currency))
-    currencies = result.scalars().all()
-
-    currency_rates = {
-        currency.id: Decimal(currency.rate_to_base) for currency in currencies
-    }
-
-    target_rate = currency_rates.get(target_currency_id)
-    if target_rate is None or target_rate == 0:
-        raise ValueError("Целевая валюта не найдена или некорректна")
-
-    total_converted = Decimal("0")
-
-    for amount, currency_id in transactions:
-        original_rate = currency_rates.get(currency_id)
-        if original_rate is None or original_rate == 0:
-            continue  
-
-        converted_amount = (Decimal(amount) * original_rate) / target_rate
-        total_converted += converted_amount
-
-    return total_converted.quantize(Decimal("0.01"))  
\ No newline at end of file
+def dialect_name(session: AsyncSession) -> str:
+    return session.bind.dialect.name
+
+def dialect_insert(session: AsyncSession, model):
+    # INSERT ... ON CONFLICT есть и в Postgres, и в SQLite, но строится разными классами
+    if dialect_name(session) == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+def day_start(session: AsyncSession, column):
+    # Дни считаются в UTC, так же как и при инкрементальном обновлении сводок
+    if dialect_name(session) == "sqlite":
+        return func.date(column)
+    return cast(func.timezone("UTC", column), Date)
+
+def month_start(session: AsyncSession, column):
+    if dialect_name(session) == "sqlite":
+        return func.date(column, "start of month")
+    return cast(func.date_trunc("month", func.timezone("UTC", column)), Date)
+
+def add_days(session: AsyncSession, column, days):
+    if dialect_name(session) == "sqlite":
+        return func.datetime(column, func.printf("%+d days", days))
+    return column + func.make_interval(0, 0, 0, days)
+
+def periods_elapsed(session: AsyncSession, now: datetime, since, period_days):
+    # Сколько целых периодов длиной period_days дней прошло от since до now
+    if dialect_name(session) == "sqlite":
+        return cast((func.julianday(now) - func.julianday(since)) / period_days, Integer)
+    elapsed_days = func.extract("epoch", literal(now) - since) / 86400
+    return cast(func.floor(elapsed_days / period_days), Integer)
+
+def amount_to_base(amount: Decimal, currency_id: int, moment: datetime) -> Decimal | None:
+    # Курс на дату операции из снимка валют в памяти; после записи сумма не пересчитывается
+    rate = get_currencies().rate_as_of(currency_id, moment)
+    if not rate:
+        return None
+    return (amount * rate).quantize(Decimal("0.0001"))
+
+def transaction_amount_base():
+    # Для ещё не заполненных строк — пересчёт по текущему курсу прямо в SQL
+    rate = select(Currency.rate_to_base).where(Currency.id == Transaction.currency_id).scalar_subquery()
+    return func.coalesce(Transaction.amount_base, Transaction.amount * rate)
+
+def period_to_days(period: str | None) -> int | None:
+    # Периоды лимитов хранятся строкой вида "30d"
+    if not period or not period.lower().endswith("d"):
+        return None
+    try:
+        return int(period[:-1])
+    except ValueError:
+        return None
@@ -0,0 +1,120 @@
+import asyncio
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.models import DailyRollup, MonthlyRollup, Transaction
+from app.database.query_helper import day_start, dialect_insert, month_start
+
+ROLLUP_KEYS = ("user_id", "category_id", "currency_id", "is_expense")
+
+async def _upsert_rollup(session: AsyncSession, model, period_column: str, values: dict):
+    stmt = dialect_insert(session, model).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[*ROLLUP_KEYS, period_column],
+        set_={
+            "amount": model.amount + stmt.excluded.amount,
+            "amount_base": model.amount_base + stmt.excluded.amount_base,
+            "tx_count": model.tx_count + stmt.excluded.tx_count,
+            "updated": func.now(),
+        },
+    )
+    await session.execute(stmt)
+
+async def orm_apply_rollup(
+    session: AsyncSession,
+    user_id: int,
+    category_id: int,
+    currency_id: int,
+    is_expense: bool,
+    amount: Decimal,
+    amount_base: Decimal,
+    created: datetime,
+    tx_count: int = 1,
+):
+    # Добавляет сумму в дневную и месячную сводку, коммит делает вызывающий код
+    created = created.astimezone(timezone.utc)
+    values = {
+        "user_id": user_id,
+        "category_id": category_id,
+        "currency_id": currency_id,
+        "is_expense": is_expense,
+        "amount": amount,
+        "amount_base": amount_base,
+        "tx_count": tx_count,
+    }
+
+    await _upsert_rollup(session, DailyRollup, "day", {**values, "day": created.date()})
+    await _upsert_rollup(
+        session, MonthlyRollup, "month",
+        {**values, "month": date(created.year, created.month, 1)}
+    )
+
+async def orm_rebuild_rollups(session: AsyncSession, user_id: int | None = None):
+    # Полный пересчёт сводок из сырых транзакций (для всех пользователей или одного)
+    daily_delete = delete(DailyRollup)
+    monthly_delete = delete(MonthlyRollup)
+    if user_id is not None:
+        daily_delete = daily_delete.where(DailyRollup.user_id == user_id)
+        monthly_delete = monthly_delete.where(MonthlyRollup.user_id == user_id)
+    await session.execute(daily_delete)
+    await session.execute(monthly_delete)
+
+    for model, period_column, period_expr in (
+        (DailyRollup, "day", day_start(session, Transaction.created)),
+        (MonthlyRollup, "month", month_start(session, Transaction.created)),
+    ):
+        period_expr = period_expr.label(period_column)
+        source = (
+            select(
+                Transaction.user_id,
+                Transaction.category_id,
+                Transaction.currency_id,
+                Transaction.is_expense,
+                period_expr,
+                func.sum(Transaction.amount),
+                # Только уже посчитанный amount_base: остальное досчитает backfill_amount_base,
+                # иначе он добавил бы эти суммы в сводку второй раз
+                func.coalesce(func.sum(Transaction.amount_base), 0),
+                func.count(Transaction.id),
+            )
+            .group_by(
+                Transaction.user_id,
+                Transaction.category_id,
+                Transaction.currency_id,
+                Transaction.is_expense,
+                period_expr,
+            )
+        )
+        if user_id is not None:
+            source = source.where(Transaction.user_id == user_id)
+
+        await session.execute(
+            insert(model).from_select(
+                [*ROLLUP_KEYS, period_column, "amount", "amount_base", "tx_count"], source
+            )
+        )
+
+    await session.commit()
+
+async def orm_ensure_rollups(session: AsyncSession):
+    # Первый запуск на базе, где транзакции уже есть, а сводок ещё нет,
+    # или сводки построены до появления amount_base
+    has_rollups = await session.scalar(select(MonthlyRollup.id).limit(1))
+    has_transactions = await session.scalar(select(Transaction.id).limit(1))
+    stale_rollups = await session.scalar(select(MonthlyRollup.id).where(MonthlyRollup.amount_base == None).limit(1))
+
+    if has_transactions and (has_rollups is None or stale_rollups is not None):
+        await orm_rebuild_rollups(session)
+
+async def _rebuild_all():
+    from app.database.engine import session_maker
+
+    async with session_maker() as session:
+        await orm_rebuild_rollups(session)
+
+if __name__ == '__main__':
+    from dotenv import find_dotenv, load_dotenv
+    load_dotenv(find_dotenv())
+
+    asyncio.run(_rebuild_all())
@@ -6,6 +6,7 @@ from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.models import Category
 from app.handlers.states import CategoryState
+from app.middlewares.user_context import UserContext
 
 import app.database.orm_query as qr
 import app.keyboards.keyboard as kb
@@ -13,37 +14,47 @@ import app.keyboards.keyboard as kb
 router = Router()
 
 @router.message(F.text == '➕Добавить категорию')
-async def add_category(message: Message, state: FSMContext, session: AsyncSession):
-    user = await qr.orm_get_user_by_tg_id(session, message.from_user.id)
-    if not user:
+async def add_category(message: Message, state: FSMContext, user_ctx: UserContext | None):
+    if not user_ctx:
         return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
     
-    await state.update_data(user_id=user.id)
+    await state.update_data(user_id=user_ctx.user_id)
     await message.answer("Введите название новой категории:")
     await state.set_state(CategoryState.waiting_for_name)
 
 @router.message(F.text == '🗑️Удалить категорию')
-async def delete_category(message: Message, state: FSMContext, session: AsyncSession):
+async def delete_category(message: Message, state: FSMContext, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
     await message.answer('Выберите категорию, которую хотите удалить', reply_markup= 
-                                                                await kb.categories(session, 'delete'))
+                                                                await kb.categories(session, user_ctx.user_id, 'delete', user_ctx.categories_stamp))
 
 @router.message(F.text == '♻️Восстановить категорию')
-async def delete_category(message: Message, state: FSMContext, session: AsyncSession):
+async def restore_category(message: Message, state: FSMContext, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
     await message.answer('Выберите категорию, которую хотите восстановить', reply_markup= 
-                                                                await kb.deleted_categories(session, 'restore'))
+                                                                await kb.deleted_categories(session, user_ctx.user_id, 'restore', user_ctx.categories_stamp))
 
 @router.message(F.text == '✏️Редактировать категорию')
-async def delete_category(message: Message, state: FSMContext, session: AsyncSession):
+async def update_category(message: Message, state: FSMContext, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
     await message.answer('Выберите категорию, которую хотите отредактировать', reply_markup= 
-                                                                await kb.categories(session, 'update'))
+                                                                await kb.categories(session, user_ctx.user_id, 'update', user_ctx.categories_stamp))
     
 @router.message(F.text == '📁Список категорий')
-async def get_category_list(message: Message, state: FSMContext, session: AsyncSession):
-    all_categories = await qr.orm_get_categories(session)
-    active_categories = [category for category in all_categories if not category.is_deleted]
+async def get_category_list(message: Message, state: FSMContext, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
+    active_categories = await qr.orm_get_user_categories(session, user_ctx.user_id)
 
     if not active_categories:
-        return "Нет активных категорий."
+        return await message.answer("Нет активных категорий.")
 
     categories_text = "\n".join([category.name for category in active_categories])
     await message.answer("Список всех ваших категорий")
@@ -59,6 +70,7 @@ async def receive_category_name(message: Message, state: FSMContext, session: As
         return await message.answer("❌ Имя категории не может быть пустым. Попробуйте еще раз:")
 
     await qr.orm_add_category(session, user_id=state_data['user_id'], name=category_name)
+    kb.invalidate_category_keyboards(state_data['user_id'])
     await message.answer(f"✅ Категория '{category_name}' была успешно добавлена!")
     await state.clear()
 
@@ -80,12 +92,13 @@ async def receive_category_update(message: Message, state: FSMContext, session:
 
     old_name = category.name
     await qr.orm_update_category(session, category_id, category_name=new_name)
+    kb.invalidate_category_keyboards(category.user_id)
 
     await message.answer(f"✅ Категория \"{old_name}\" успешно переименована в \"{new_name}\"!")
     await state.clear()
 
 @router.message(F.text.lower().in_(["да", "нет"]), CategoryState.waiting_for_confirmation)
-async def confirm_category_action(message: Message, state: FSMContext, session: AsyncSession):
+async def confirm_category_action(message: Message, state: FSMContext, session: AsyncSession, user_ctx: UserContext | None):
     user_input = message.text.lower()
     data = await state.get_data()
 
@@ -101,6 +114,9 @@ async def confirm_category_action(message: Message, state: FSMContext, session:
             await message.answer("✅ Категория восстановлена")
         else:
             await message.answer("❌ Неизвестное действие")
+
+        if user_ctx:
+            kb.invalidate_category_keyboards(user_ctx.user_id)
     else:
         await message.answer("❌ Действие отменено")
 
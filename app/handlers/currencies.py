@@ -4,16 +4,15 @@ from aiogram.fsm.context import FSMContext
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.charts.cache import chart_cache
+from app.middlewares.user_context import UserContext, invalidate_user_context
 import app.database.orm_query as qr
 
 router = Router()
 
 @router.callback_query(F.data.startswith('currency_'))
-async def handle_currency_action(callback: CallbackQuery, session: AsyncSession):
-    user_tg_id = callback.from_user.id
-    user = await qr.orm_get_user_by_tg_id(session, user_tg_id)
-
-    if not user:
+async def handle_currency_action(callback: CallbackQuery, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
         return await callback.message.answer("❌ Пользователь не найден. Пожалуйста, используйте /start.")
 
     currency_id = int(callback.data.split("_")[1])
@@ -22,6 +21,8 @@ async def handle_currency_action(callback: CallbackQuery, session: AsyncSession)
     if not currency:
         return await callback.message.answer("❌ Валюта не найдена.")
 
-    await qr.set_user_currency(session, user_id=user.id, currency_id=currency_id)
+    await qr.set_user_currency(session, user_id=user_ctx.user_id, currency_id=currency_id)
+    invalidate_user_context(callback.from_user.id)
+    chart_cache.invalidate_user(user_ctx.user_id)
     await callback.message.answer(f"✅ Ваша валюта изменена на {currency.name} ({currency.symbol})")
     await callback.answer()
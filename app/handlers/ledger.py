@@ -0,0 +1,119 @@
+import io
+import os
+import tempfile
+from datetime import date
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.types import FSInputFile, Message
+from aiogram.fsm.context import FSMContext
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.charts.cache import chart_cache
+from app.database.ledger_io import import_transactions_csv, iter_export_rows, write_csv, write_xlsx
+from app.handlers.states import ImportState
+from app.middlewares.user_context import UserContext
+
+import app.keyboards.keyboard as kb
+
+router = Router()
+
+# Больше 20 МБ Bot API скачать не даст
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+
+@router.message(Command('import'))
+async def start_import(message: Message, state: FSMContext, user_ctx: UserContext | None):
+    if not user_ctx:
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
+    await message.answer(
+        "📥 Отправьте CSV-файл с колонками <code>date,amount,currency,category,comment</code>.\n"
+        "Дата — <code>2024-05-31</code> или <code>31.05.2024</code>, сумма с «+» — доход, без знака — расход.\n"
+        "Для отмены отправьте «-».",
+        parse_mode="HTML"
+    )
+    await state.set_state(ImportState.waiting_for_file)
+
+@router.message(ImportState.waiting_for_file, F.document)
+async def receive_import_file(message: Message, state: FSMContext, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
+        await state.clear()
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
+    document = message.document
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        return await message.answer("❌ Файл слишком большой (максимум 20 МБ).")
+
+    await message.answer("⏳ Импортирую, это может занять несколько секунд...")
+
+    # Файл скачивается на диск и читается построчно, целиком в память не попадает
+    with tempfile.TemporaryFile() as raw_file:
+        await message.bot.download(document, destination=raw_file)
+        raw_file.seek(0)
+
+        with io.TextIOWrapper(raw_file, encoding="utf-8-sig", errors="replace", newline="") as lines:
+            try:
+                report = await import_transactions_csv(
+                    session, user_ctx.user_id, lines, default_currency_id=user_ctx.currency_id
+                )
+            except ValueError as error:
+                return await message.answer(f"❌ Не удалось прочитать файл: {error}")
+
+    chart_cache.invalidate_user(user_ctx.user_id)
+    if report.created_categories or report.restored_categories:
+        kb.invalidate_category_keyboards(user_ctx.user_id)
+    await state.clear()
+
+    text = f"✅ Импортировано операций: {report.imported}\n"
+    if report.created_categories:
+        text += "Созданы категории: " + ", ".join(report.created_categories) + "\n"
+    if report.restored_categories:
+        text += "Восстановлены категории: " + ", ".join(report.restored_categories) + "\n"
+    if report.skipped:
+        text += f"Пропущено строк: {report.skipped}\n" + "\n".join(report.errors)
+    await message.answer(text)
+
+@router.message(ImportState.waiting_for_file)
+async def cancel_import(message: Message, state: FSMContext):
+    if message.text and message.text.strip() == '-':
+        await state.clear()
+        return await message.answer("❌ Импорт отменён")
+
+    await message.answer("Отправьте CSV-файл документом или «-» для отмены.")
+
+EXPORT_WRITERS = {"csv": write_csv, "xlsx": write_xlsx}
+
+@router.message(Command('export'))
+async def export_ledger(message: Message, command: CommandObject, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
+    file_format = (command.args or "csv").strip().lower()
+    writer = EXPORT_WRITERS.get(file_format)
+    if writer is None:
+        return await message.answer("❌ Поддерживаются форматы: csv, xlsx")
+
+    await message.answer("⏳ Готовлю выгрузку...")
+
+    # Строки идут из курсора прямо в файл на диске; отправляется файл по пути,
+    # так что ни выборка, ни готовый документ целиком в памяти не держатся
+    fd, path = tempfile.mkstemp(suffix=f".{file_format}")
+    os.close(fd)
+    try:
+        rows = iter_export_rows(session, user_ctx.user_id, user_ctx.currency_id)
+        try:
+            count = await writer(rows, path)
+        except (ValueError, RuntimeError) as error:
+            return await message.answer(f"❌ Не удалось выгрузить историю: {error}")
+
+        if count <= 0:
+            return await message.answer("📭 У вас пока нет операций.")
+
+        filename = f"ledger_{date.today():%Y%m%d}.{file_format}"
+        await message.answer_document(
+            FSInputFile(path, filename=filename),
+            caption=f"📤 Операций: {count}, суммы в {user_ctx.currency_symbol}"
+        )
+    finally:
+        os.unlink(path)
+
@@ -7,6 +7,7 @@ from aiogram.fsm.context import FSMContext
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.handlers.states import LimitState
+from app.middlewares.user_context import UserContext
 
 
 from app.utils.constants import PERIODS
@@ -17,7 +18,7 @@ import app.keyboards.keyboard as kb
 router = Router()
 
 @router.message(LimitState.waiting_for_amount)
-async def enter_limit(message: Message, state: FSMContext, session: AsyncSession):
+async def enter_limit(message: Message, state: FSMContext):
     try:
         limit_amount = float(message.text.replace(',','.'))
     except ValueError:
@@ -27,10 +28,8 @@ async def enter_limit(message: Message, state: FSMContext, session: AsyncSession
     await state.set_state(LimitState.waiting_for_period)
 
 @router.message(LimitState.waiting_for_period)
-async def enter_limit_period(message: Message, state: FSMContext, session: AsyncSession):
+async def enter_limit_period(message: Message, state: FSMContext):
     user_input = message.text.strip().lower()
-    user = await qr.orm_get_user_by_tg_id(session, message.from_user.id)
-    state_data = await state.get_data()
 
     if user_input in PERIODS:
         period = PERIODS[user_input]
@@ -48,7 +47,7 @@ async def enter_limit_period(message: Message, state: FSMContext, session: Async
     await state.set_state(LimitState.waiting_for_confirmation)
 
 @router.message(LimitState.waiting_for_confirmation)
-async def confirm_limit_updating(message: Message, session: AsyncSession, state: FSMContext):
+async def confirm_limit_updating(message: Message, session: AsyncSession, state: FSMContext, user_ctx: UserContext | None):
     user_response = message.text.strip().lower()
     is_updating = None
 
@@ -60,23 +59,24 @@ async def confirm_limit_updating(message: Message, session: AsyncSession, state:
         await message.answer("❌ Введите 'да' или 'нет'")
         return
 
+    if not user_ctx:
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
     state_data = await state.get_data()
-    user = await qr.orm_get_user_by_tg_id(session, message.from_user.id)
-    user_currency = await qr.orm_get_user_currency(session, user.id)
 
     data = {
-        "user_id": user.id,
+        "user_id": user_ctx.user_id,
         "category_id": state_data["category_id"],
         "limit_amount": state_data["limit_amount"],
         "period": state_data["period"],
         "is_updating": is_updating,
-        "currency_id": user_currency.id,
+        "currency_id": user_ctx.currency_id,
         "start_date": datetime.now(timezone.utc),
     }
 
     await qr.orm_set_category_limit(session, data)
 
     updating_text = "с автообновлением" if is_updating else "без автообновления"
-    await message.answer(f"✅ Лимит установлен: {data['limit_amount']}{user_currency.symbol} на период: {data['period']} ({updating_text})")
+    await message.answer(f"✅ Лимит установлен: {data['limit_amount']}{user_ctx.currency_symbol} на период: {data['period']} ({updating_text})")
 
     await state.clear()
\ No newline at end of file
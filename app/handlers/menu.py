@@ -12,25 +12,25 @@ router = Router()
 
 @router.message(F.text == '🗃️Категории')
 async def get_category_menu(message: Message, session: AsyncSession):
-    await message.answer("⚙️ Здесь вы можете настроить свои категории", reply_markup=await kb.category_menu())
+    await message.answer("⚙️ Здесь вы можете настроить свои категории", reply_markup=kb.CATEGORY_MENU)
 
 @router.message(F.text == '📊Статистика')
-async def get_category_menu(message: Message, session: AsyncSession):
-    await message.answer("📊Здесь вы можете отслеживать свои доходы и расходы", reply_markup=await kb.statistics_menu())
+async def get_statistics_menu(message: Message, session: AsyncSession):
+    await message.answer("📊Здесь вы можете отслеживать свои доходы и расходы", reply_markup=kb.STATISTICS_MENU)
 
 @router.message(F.text == '🔙Назад')
-async def get_category_menu(message: Message, session: AsyncSession):
-    await message.answer("🔙Возвращаемся в главное меню", reply_markup=await kb.main_menu())
+async def back_to_main_menu(message: Message, session: AsyncSession):
+    await message.answer("🔙Возвращаемся в главное меню", reply_markup=kb.MAIN_MENU)
 
 @router.callback_query(F.data == "to_main")
 async def handle_to_main_callback(callback: CallbackQuery, state: FSMContext):
     await state.clear()
-    await callback.message.edit_text("🔙 Возврат в главное меню", reply_markup=await kb.main_menu())
+    await callback.message.edit_text("🔙 Возврат в главное меню", reply_markup=kb.MAIN_MENU)
     await callback.answer()
 
 @router.message(F.text == '⚙️Настройки')
 async def get_setting_menu(message: Message, session: AsyncSession):
-    await message.answer('Меню настроек', reply_markup= await kb.settings_menu())
+    await message.answer('Меню настроек', reply_markup= kb.SETTINGS_MENU)
 
 @router.message(F.text == '💱Выбрать валюту')
 async def select_currency(message: Message, session: AsyncSession):
@@ -12,4 +12,7 @@ class CategoryState(StatesGroup):
 class LimitState(StatesGroup):
     waiting_for_amount = State()
     waiting_for_period = State()
-    waiting_for_confirmation = State()
\ No newline at end of file
+    waiting_for_confirmation = State()
+
+class ImportState(StatesGroup):
+    waiting_for_file = State()
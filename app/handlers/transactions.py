@@ -5,25 +5,38 @@ from aiogram.filters import CommandStart, Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.models import Currency, Setting
+from app.charts.cache import chart_cache
+from app.database.currency_cache import get_currencies
 from app.handlers.states import LimitState, TransactionState, CategoryState
+from app.middlewares.user_context import UserContext, invalidate_user_context
 
 import app.database.orm_query as qr
 import app.keyboards.keyboard as kb
 
 router = Router()
 
-@router.message(CommandStart())
-async def cmd_start(message: Message, session: AsyncSession):
-    existing_user = await qr.orm_get_user_by_tg_id(session, message.from_user.id)
+TRANSACTIONS_PAGE_SIZE = 5
+
+def _format_transactions(transactions, currency_map: dict) -> str:
+    text = ""
+    for tx in transactions:
+        icon = "🔻" if tx.is_expense else "🟢"
+        local_time = tx.created + timedelta(hours=7)
+        date = local_time.strftime('%d-%m-%Y %H:%M')
+        comment = f" - {tx.comment}" if tx.comment else ""
+        sign = "-" if tx.is_expense else "+"
+        tx_currency_symbol = currency_map.get(tx.currency_id, "₽")
+        text += f"{icon} {sign}{tx.amount:.2f}{tx_currency_symbol} ({date}){comment}\n"
+    return text
 
-    if existing_user:
+@router.message(CommandStart())
+async def cmd_start(message: Message, session: AsyncSession, user_ctx: UserContext | None):
+    if user_ctx:
         await message.answer(
             "👋 Вы уже зарегистрированы! Открываю главное меню.",
-            reply_markup=await kb.main_menu()
+            reply_markup=kb.MAIN_MENU
         )
         return
 
@@ -32,23 +45,76 @@ async def cmd_start(message: Message, session: AsyncSession):
     await qr.orm_add_default_categories(session, user_id)
     await qr.orm_add_default_settings(session, user_id)
     await session.commit()
+    invalidate_user_context(message.from_user.id)
 
-    await message.answer("✅ Вы были успешно зарегистрированы в боте!", reply_markup=await kb.main_menu())
+    await message.answer("✅ Вы были успешно зарегистрированы в боте!", reply_markup=kb.MAIN_MENU)
+
+@router.callback_query(F.data.startswith('txpage_'))
+async def page_transactions(callback: CallbackQuery, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
+        return await callback.message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
+    _, category_id, direction, cursor_id = callback.data.split("_")
+    category_id, cursor_id = int(category_id), int(cursor_id)
+
+    if direction == "older":
+        transactions, has_older = await qr.orm_get_transactions_page(
+            session, user_ctx.user_id, category_id, limit=TRANSACTIONS_PAGE_SIZE, before_id=cursor_id
+        )
+        has_newer = True
+    else:
+        transactions, has_newer = await qr.orm_get_transactions_page(
+            session, user_ctx.user_id, category_id, limit=TRANSACTIONS_PAGE_SIZE, after_id=cursor_id
+        )
+        has_older = True
+        if not has_newer:
+            # Дошли до начала — показываем полную первую страницу, а не её хвост
+            transactions, has_older = await qr.orm_get_transactions_page(
+                session, user_ctx.user_id, category_id, limit=TRANSACTIONS_PAGE_SIZE
+            )
+
+    if not transactions:
+        return await callback.answer("Больше транзакций нет")
+
+    category = await qr.orm_get_category_by_id(session, category_id)
+    currency_map = {currency.id: currency.display for currency in get_currencies().all()}
+
+    text = (
+        f"<b>Категория:</b> {category.name}\n"
+        "<b>Транзакции:</b>\n" + _format_transactions(transactions, currency_map)
+    )
+    await callback.message.edit_text(
+        text,
+        parse_mode="HTML",
+        reply_markup=await kb.transactions_pager(
+            category_id, transactions[0].id, transactions[-1].id, has_newer=has_newer, has_older=has_older
+        )
+    )
+    await callback.answer()
 
 @router.message(F.text == '📉Установить лимит')
-async def get_categories(message: Message, session: AsyncSession):
-    await message.answer('Выберите категорию на которую хотите установить лимит:', reply_markup= await kb.categories(session, 'setlimit'))
+async def get_categories(message: Message, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
+    await message.answer('Выберите категорию на которую хотите установить лимит:', reply_markup= await kb.categories(session, user_ctx.user_id, 'setlimit', user_ctx.categories_stamp))
 
 @router.message(F.text == '💸Записать трату/доход')
-async def make_transaction(message: Message, session: AsyncSession):
-    await message.answer('Выберите категорию из списка', reply_markup= await kb.categories(session, 'add'))
+async def make_transaction(message: Message, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
+    await message.answer('Выберите категорию из списка', reply_markup= await kb.categories(session, user_ctx.user_id, 'add', user_ctx.categories_stamp))
 
 @router.message(F.text == '🧾История транзакций по категории')
-async def view_category_expenses(message: Message, session: AsyncSession):
-    await message.answer('Выберите категорию', reply_markup= await kb.categories(session, 'view'))
+async def view_category_expenses(message: Message, session: AsyncSession, user_ctx: UserContext | None):
+    if not user_ctx:
+        return await message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
+
+    await message.answer('Выберите категорию', reply_markup= await kb.categories(session, user_ctx.user_id, 'view', user_ctx.categories_stamp))
     
 @router.callback_query(F.data.startswith('category_'))
-async def handle_category_action(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+async def handle_category_action(callback: CallbackQuery, state: FSMContext, session: AsyncSession, user_ctx: UserContext | None):
    action = callback.data.split("_")[1]
    category_id = int(callback.data.split("_")[2])
    category = await qr.orm_get_category_by_id(session, category_id)
@@ -59,39 +125,38 @@ async def handle_category_action(callback: CallbackQuery, state: FSMContext, ses
     await state.set_state(TransactionState.waiting_for_amount)
 
    elif action == "view":
-    user = await qr.orm_get_user_by_tg_id(session, callback.from_user.id)
-    limit = await qr.orm_get_category_limit(session, user.id, category_id)
+    if not user_ctx:
+        return await callback.message.answer("❌ Пользователь не найден. Пожалуйста, используйте команду /start.")
 
-    # Получаем валюту пользователя
-    user_currency_id_result = await session.execute(
-        select(Setting.currency_id).where(Setting.user_id == user.id)
-    )
-    user_currency_id = user_currency_id_result.scalar_one_or_none()
+    limit = await qr.orm_get_category_limit(session, user_ctx.user_id, category_id)
 
-    # Получаем курсы валют
-    currencies_result = await session.execute(select(Currency))
-    currencies_list = list(currencies_result.scalars())
+    # Валюта пользователя и курсы из кэша
+    user_currency = user_ctx.currency
+    currencies = get_currencies()
     currency_map = {
-        currency.id: currency.symbol or currency.code
-        for currency in currencies_list
-    }
-    currency_rates = {
-        currency.id: currency.rate_to_base
-        for currency in currencies_list
+        currency.id: currency.display
+        for currency in currencies.all()
     }
 
-    user_rate = currency_rates.get(user_currency_id)
-    limit_rate = currency_rates.get(limit.currency_id) if limit else None
+    user_rate = user_currency.rate_to_base if user_currency else None
+    limit_rate = currencies.rate(limit.currency_id) if limit else None
 
     # Получаем траты
-    total, totals_by_currency = await qr.orm_get_total_amount_by_category(session, user.id, category_id)
-    transactions = await qr.orm_get_last_transactions(session, user.id, category_id, limit=5)
+    total, totals_by_currency = await qr.orm_get_total_amount_by_category(
+        session, user_ctx.user_id, category_id, user_ctx.currency_id
+    )
+    transactions, has_older = await qr.orm_get_transactions_page(
+        session, user_ctx.user_id, category_id, limit=TRANSACTIONS_PAGE_SIZE
+    )
 
     text = f"<b>Категория:</b> {category.name}\n"
 
     # Отображение лимита
     if limit and user_rate and limit_rate:
-        total_in_limit_currency = total * (user_rate / limit_rate)
+        if limit.spent is not None:
+            total_in_limit_currency = limit.spent
+        else:
+            total_in_limit_currency = total * (user_rate / limit_rate)
         percent_used = (Decimal(total_in_limit_currency) / limit.limit_amount * 100) if limit.limit_amount > 0 else 0
         limit_currency_symbol = currency_map.get(limit.currency_id, "₽")
         text += (
@@ -109,20 +174,16 @@ async def handle_category_action(callback: CallbackQuery, state: FSMContext, ses
             text += f"  • {amount:.2f}{sym}\n"
 
     # Последние транзакции
+    reply_markup = None
     if transactions:
-        text += "<b>Последние транзакции:</b>\n"
-        for tx in transactions:
-            icon = "🔻" if tx.is_expense else "🟢"
-            local_time = tx.created + timedelta(hours=7)
-            date = local_time.strftime('%d-%m-%Y %H:%M')
-            comment = f" - {tx.comment}" if tx.comment else ""
-            sign = "-" if tx.is_expense else "+"
-            tx_currency_symbol = currency_map.get(tx.currency_id, "₽")
-            text += f"{icon} {sign}{tx.amount:.2f}{tx_currency_symbol} ({date}){comment}\n"
+        text += "<b>Последние транзакции:</b>\n" + _format_transactions(transactions, currency_map)
+        reply_markup = await kb.transactions_pager(
+            category_id, transactions[0].id, transactions[-1].id, has_newer=False, has_older=has_older
+        )
     else:
         text += "Нет транзакций в этой категории."
 
-    await callback.message.answer(text, parse_mode="HTML")
+    await callback.message.answer(text, parse_mode="HTML", reply_markup=reply_markup)
     await callback.answer()
    
    elif action == "setlimit":
@@ -164,30 +225,29 @@ async def enter_amount(message: Message, state: FSMContext):
     await state.set_state(TransactionState.waiting_for_comment)
 
 @router.message(TransactionState.waiting_for_comment)
-async def enter_comment(message: Message, state: FSMContext, session: AsyncSession):
+async def enter_comment(message: Message, state: FSMContext, session: AsyncSession, user_ctx: UserContext | None):
     state_data = await state.get_data()
     comment = message.text if message.text != '-' else ''
 
-    user = await qr.orm_get_user_by_tg_id(session, message.from_user.id)
-    if not user:
+    if not user_ctx:
         return await message.answer("Пользователь не найден. Пожалуйста, используйте команду /start.")
     
-    user_currency = await qr.orm_get_user_currency(session, user.id)
-    if not user_currency:
+    if not user_ctx.currency_id:
         return await message.answer("Не удалось получить настройки пользователя.")
 
     data = {
-        "user_id": user.id,
+        "user_id": user_ctx.user_id,
         "category_id": state_data["category_id"],
         "amount": state_data["amount"],
         "is_expense": state_data["is_expense"],
         "comment": comment,
-        "currency_id": user_currency.id 
+        "currency_id": user_ctx.currency_id
     }
 
     await qr.orm_make_transaction(session, data)
+    chart_cache.invalidate_user(user_ctx.user_id)
 
-    exceeded, percent = await qr.check_limit(session, user_id=user.id, category_id=state_data["category_id"])
+    exceeded, percent = await qr.check_limit(session, user_id=user_ctx.user_id, category_id=state_data["category_id"])
 
     if exceeded:
         await message.answer(
@@ -199,6 +259,8 @@ async def enter_comment(message: Message, state: FSMContext, session: AsyncSessi
             f"⚠️ Вы использовали {percent:.1f}% лимита по категории.\n"
             f"Осторожнее с расходами!"
         )
+    if percent is not None and percent >= 80:
+        await qr.orm_mark_limit_alerted(session, user_id=user_ctx.user_id, category_id=state_data["category_id"])
 
     await message.answer('Данные были успешно записаны')
     await state.clear()
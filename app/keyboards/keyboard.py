@@ -1,25 +1,52 @@
+import os
 from aiogram.types import (ReplyKeyboardMarkup, KeyboardButton,
                            InlineKeyboardMarkup, InlineKeyboardButton)
 from sqlalchemy.ext.asyncio import AsyncSession
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from app.database.orm_query import orm_get_categories, orm_get_currencies
+from app.database.orm_query import orm_get_user_categories, orm_get_currencies
+from app.utils.cache import TTLCache
 
-async def categories(session: AsyncSession, action: str):
-    all_categories = await orm_get_categories(session)
-    
-    active_categories = [category for category in all_categories if not category.is_deleted]
+# Готовые inline-клавиатуры категорий: user_id -> (штамп категорий, {(action, deleted): markup}).
+# Штамп приходит из UserContext и меняется при любой правке категорий, в том числе
+# из другого процесса; без штампа клавиатура собирается заново.
+# В своём процессе кэш дополнительно сбрасывается сразу после правки.
+category_keyboards = TTLCache(
+    max_size=int(os.getenv('KEYBOARD_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('KEYBOARD_CACHE_TTL', '3600')),
+)
 
-    keyboard = InlineKeyboardBuilder()
-    for category in active_categories:
-        keyboard.add(
-            InlineKeyboardButton(
-                text=category.name,
-                callback_data=f"category_{action}_{category.id}"
+def invalidate_category_keyboards(user_id: int):
+    category_keyboards.pop(user_id)
+
+async def _category_keyboard(
+    session: AsyncSession, user_id: int, action: str, deleted: bool, stamp: tuple | None
+) -> InlineKeyboardMarkup:
+    cached = category_keyboards.get(user_id) if stamp is not None else None
+    if cached is not None and cached[0] == stamp:
+        user_keyboards = cached[1]
+    else:
+        user_keyboards = {}
+        if stamp is not None:
+            category_keyboards.set(user_id, (stamp, user_keyboards))
+
+    markup = user_keyboards.get((action, deleted))
+    if markup is None:
+        keyboard = InlineKeyboardBuilder()
+        for category in await orm_get_user_categories(session, user_id, deleted=deleted):
+            keyboard.add(
+                InlineKeyboardButton(
+                    text=category.name,
+                    callback_data=f"category_{action}_{category.id}"
+                )
             )
-        )
-    keyboard.add(InlineKeyboardButton(text="Cancel", callback_data="to_main"))
-    return keyboard.adjust(1).as_markup()
+        keyboard.add(InlineKeyboardButton(text="Cancel", callback_data="to_main"))
+        markup = user_keyboards[(action, deleted)] = keyboard.adjust(1).as_markup()
+
+    return markup
+
+async def categories(session: AsyncSession, user_id: int, action: str, stamp: tuple | None = None):
+    return await _category_keyboard(session, user_id, action, deleted=False, stamp=stamp)
 
 async def currencies(session: AsyncSession):
     all_currencies = await orm_get_currencies(session)
@@ -35,64 +62,57 @@ async def currencies(session: AsyncSession):
     keyboard.add(InlineKeyboardButton(text="Cancel", callback_data="to_main"))
     return keyboard.adjust(1).as_markup()
 
-async def deleted_categories(session: AsyncSession, action: str):
-    all_categories = await orm_get_categories(session)
-    
-    active_categories = [category for category in all_categories if category.is_deleted]
+async def deleted_categories(session: AsyncSession, user_id: int, action: str, stamp: tuple | None = None):
+    return await _category_keyboard(session, user_id, action, deleted=True, stamp=stamp)
 
+async def transactions_pager(category_id: int, newest_id: int, oldest_id: int, has_newer: bool, has_older: bool):
+    # В callback_data только id крайних транзакций — укладывается в 64 байта
     keyboard = InlineKeyboardBuilder()
-    for category in active_categories:
-        keyboard.add(
-            InlineKeyboardButton(
-                text=category.name,
-                callback_data=f"category_{action}_{category.id}"
-            )
-        )
-    keyboard.add(InlineKeyboardButton(text="Cancel", callback_data="to_main"))
-    return keyboard.adjust(1).as_markup()
+    if has_newer:
+        keyboard.add(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"txpage_{category_id}_newer_{newest_id}"))
+    if has_older:
+        keyboard.add(InlineKeyboardButton(text="Старее ➡️", callback_data=f"txpage_{category_id}_older_{oldest_id}"))
+    return keyboard.as_markup() if has_newer or has_older else None
 
-async def main_menu():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="💸Записать трату/доход"), KeyboardButton(text="📉Установить лимит")],
-            [KeyboardButton(text="📊Статистика")],
-            [KeyboardButton(text="🗃️Категории"), KeyboardButton(text="⚙️Настройки")]
-        ],
-        resize_keyboard=True,
-        input_field_placeholder = 'Выберите действие',
-        one_time_keyboard=False
-    )
+# Статичные меню не зависят от пользователя и собираются один раз при импорте
+MAIN_MENU = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="💸Записать трату/доход"), KeyboardButton(text="📉Установить лимит")],
+        [KeyboardButton(text="📊Статистика")],
+        [KeyboardButton(text="🗃️Категории"), KeyboardButton(text="⚙️Настройки")]
+    ],
+    resize_keyboard=True,
+    input_field_placeholder = 'Выберите действие',
+    one_time_keyboard=False
+)
 
-async def category_menu():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="➕Добавить категорию")],
-            [KeyboardButton(text="🗑️Удалить категорию"), KeyboardButton(text="♻️Восстановить категорию")],
-            [KeyboardButton(text="✏️Редактировать категорию"), KeyboardButton(text="📁Список категорий")],
-            [KeyboardButton(text="🔙Назад")]
-        ],
-        resize_keyboard=True,
-        input_field_placeholder = 'Выберите действие'
-    )
+CATEGORY_MENU = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="➕Добавить категорию")],
+        [KeyboardButton(text="🗑️Удалить категорию"), KeyboardButton(text="♻️Восстановить категорию")],
+        [KeyboardButton(text="✏️Редактировать категорию"), KeyboardButton(text="📁Список категорий")],
+        [KeyboardButton(text="🔙Назад")]
+    ],
+    resize_keyboard=True,
+    input_field_placeholder = 'Выберите действие'
+)
 
-async def statistics_menu():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="💸Все расходы"), KeyboardButton(text="💰Все доходы")],
-            [KeyboardButton(text="📉Доля расходов"), KeyboardButton(text="📈Доля доходов")],
-            [KeyboardButton(text="🧾История транзакций по категории")],
-            [KeyboardButton(text="🗓️Полугодовой отчет")],
-            [KeyboardButton(text="🔙Назад")]
-        ],
-        resize_keyboard=True,
-        input_field_placeholder = 'Выберите действие'
-    )
+STATISTICS_MENU = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="💸Все расходы"), KeyboardButton(text="💰Все доходы")],
+        [KeyboardButton(text="📉Доля расходов"), KeyboardButton(text="📈Доля доходов")],
+        [KeyboardButton(text="🧾История транзакций по категории")],
+        [KeyboardButton(text="🗓️Полугодовой отчет")],
+        [KeyboardButton(text="🔙Назад")]
+    ],
+    resize_keyboard=True,
+    input_field_placeholder = 'Выберите действие'
+)
 
-async def settings_menu():
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="💱Выбрать валюту"), KeyboardButton(text="🔙Назад")],
-        ],
-        resize_keyboard=True,
-        input_field_placeholder = 'Выберите действие'
-    )
\ No newline at end of file
+SETTINGS_MENU = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="💱Выбрать валюту"), KeyboardButton(text="🔙Назад")],
+    ],
+    resize_keyboard=True,
+    input_field_placeholder = 'Выберите действие'
+)
\ No newline at end of file
@@ -8,12 +8,13 @@ class DataBaseSession(BaseMiddleware):
         self.session_pool = session_pool
 
     async def __call__(
-        self, 
-        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], 
-        event: TelegramObject, 
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
         data: Dict[str, Any]
         ) -> Any:
+        # AsyncSession берёт соединение из пула только на первом запросе и отдаёт его
+        # при закрытии сразу после хендлера — отдельная ленивая обёртка не нужна
         async with self.session_pool() as session:
             data['session'] = session
             return await handler(event, data)
-        
\ No newline at end of file
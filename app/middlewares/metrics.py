@@ -0,0 +1,69 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from app.utils.metrics import (
+    HANDLER_ERRORS, HANDLER_SECONDS, TELEGRAM_API_ERRORS, TELEGRAM_API_SECONDS,
+    UPDATE_DB_SECONDS, UPDATE_DB_STATEMENTS, UpdateStats, current_update,
+)
+
+class MetricsMiddleware(BaseMiddleware):
+    # Outer-middleware на dp.update: меряет апдейт целиком, включая фильтры и другие middleware
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+        ) -> Any:
+        stats = UpdateStats()
+        data['update_stats'] = stats
+        token = current_update.set(stats)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(router=stats.router, handler=stats.handler)
+            raise
+        finally:
+            current_update.reset(token)
+            labels = {"router": stats.router, "handler": stats.handler}
+            HANDLER_SECONDS.observe(time.perf_counter() - started, **labels)
+            UPDATE_DB_STATEMENTS.observe(stats.db_statements, **labels)
+            UPDATE_DB_SECONDS.observe(stats.db_seconds, **labels)
+
+class HandlerLabelMiddleware(BaseMiddleware):
+    # Inner-middleware: к этому моменту хендлер уже выбран, подписываем им метрики апдейта
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+        ) -> Any:
+        stats: UpdateStats | None = data.get('update_stats')
+        handler_object = data.get('handler')
+        if stats is not None and handler_object is not None:
+            callback = handler_object.callback
+            stats.router = callback.__module__.rsplit('.', 1)[-1]
+            stats.handler = callback.__name__
+        return await handler(event, data)
+
+class TelegramApiMetrics(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as error:
+            TELEGRAM_API_ERRORS.inc(method=name, error=type(error).__name__)
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - started, method=name)
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import ErrorEvent, TelegramObject
+
+from app.utils.metrics import UPDATE_QUEUE_WAIT_SECONDS, UPDATES_IN_FLIGHT, UPDATES_QUEUED, UPDATES_SHED
+
+class UpdateShed(Exception):
+    # Очередь чата переполнена: апдейт отбрасывается, не дойдя до FSM и хендлеров
+    pass
+
+@dataclass
+class _ChatQueue:
+    # asyncio.Lock будит ожидающих по порядку прихода — апдейты чата идут строго друг за другом
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Апдейты чата в работе и в ожидании
+    pending: int = 0
+
+class ChatEventIsolation(BaseEventIsolation):
+    # Передаётся в Dispatcher(events_isolation=...): встроенный FSMContextMiddleware берёт
+    # замок до чтения состояния, поэтому следующий апдейт чата видит состояние, которое
+    # оставил предыдущий. Переполненная очередь отбрасывает апдейт до get_state.
+    def __init__(self, max_queue_per_chat: int = 3):
+        self.max_queue_per_chat = max_queue_per_chat
+        self._chats: dict[tuple[int, int], _ChatQueue] = {}
+        self._queued = 0
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        chat_key = (key.bot_id, key.chat_id)
+        queue = self._chats.get(chat_key)
+        if queue is None:
+            queue = self._chats[chat_key] = _ChatQueue()
+
+        # Один апдейт в работе плюс не больше max_queue_per_chat в ожидании, остальное отбрасываем
+        if queue.pending > self.max_queue_per_chat:
+            raise UpdateShed()
+
+        queue.pending += 1
+        self._queued += 1
+        UPDATES_QUEUED.set(self._queued)
+        waiting = True
+        started = time.perf_counter()
+        try:
+            async with queue.lock:
+                waiting = False
+                self._queued -= 1
+                UPDATES_QUEUED.set(self._queued)
+                UPDATE_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started)
+                yield
+        finally:
+            # Апдейт могли отменить ещё в очереди (остановка бота)
+            if waiting:
+                self._queued -= 1
+                UPDATES_QUEUED.set(self._queued)
+            queue.pending -= 1
+            if queue.pending == 0:
+                self._chats.pop(chat_key, None)
+
+    async def close(self) -> None:
+        self._chats.clear()
+
+async def answer_shed_update(event: ErrorEvent, bot) -> bool:
+    # Регистрируется на dp.errors с ExceptionTypeFilter(UpdateShed)
+    UPDATES_SHED.inc()
+    # У нажатой inline-кнопки иначе так и крутятся часики
+    if event.update.callback_query:
+        try:
+            await bot.answer_callback_query(
+                event.update.callback_query.id, text="⏳ Предыдущие запросы ещё выполняются, подождите"
+            )
+        except TelegramAPIError:
+            logging.debug("Не удалось ответить на отброшенный callback", exc_info=True)
+    return True
+
+class UpdateScheduler(BaseMiddleware):
+    # Inner-middleware на dp.update: всего в работе не больше max_in_flight апдейтов.
+    # Порядок внутри чата держит ChatEventIsolation — сюда апдейт приходит уже под замком
+    # своего чата, поэтому чат занимает не больше одного слота, и пользователь, часто
+    # нажимающий тяжёлые кнопки, ждёт сам и не задерживает остальных.
+    def __init__(self, max_in_flight: int = 16):
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._in_flight = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+        ) -> Any:
+        async with self._slots:
+            self._in_flight += 1
+            UPDATES_IN_FLIGHT.set(self._in_flight)
+            try:
+                return await handler(event, data)
+            finally:
+                self._in_flight -= 1
+                UPDATES_IN_FLIGHT.set(self._in_flight)
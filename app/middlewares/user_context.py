@@ -0,0 +1,85 @@
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.currency_cache import CurrencyInfo, get_currencies
+from app.database.models import Category, Setting, User
+from app.utils.cache import TTLCache
+
+@dataclass(frozen=True)
+class UserContext:
+    user_id: int
+    currency_id: int | None
+    currency_symbol: str
+    # (количество категорий, max(updated)) — ключ кэша клавиатур категорий
+    categories_stamp: tuple | None = None
+
+    @property
+    def currency(self) -> CurrencyInfo | None:
+        return get_currencies().get(self.currency_id)
+
+# Кэш живёт в памяти процесса и не видит смену валюты, сделанную другим процессом,
+# поэтому по умолчанию выключен. USER_CACHE_TTL > 0 — только для запуска в один процесс.
+user_context_cache = TTLCache(
+    max_size=int(os.getenv('USER_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('USER_CACHE_TTL', '0')),
+)
+
+async def resolve_user_context(session: AsyncSession, tg_id: int) -> UserContext | None:
+    if user_context_cache.ttl > 0:
+        user_ctx = user_context_cache.get(tg_id)
+        if user_ctx is not None:
+            return user_ctx
+
+    # Штамп категорий читается тем же запросом: по нему клавиатуры из кэша
+    # сверяются с базой и устаревают, даже если категории менял другой процесс
+    categories = select(Category).where(Category.user_id == User.id)
+    categories_count = categories.with_only_columns(func.count(Category.id)).scalar_subquery()
+    categories_updated = categories.with_only_columns(func.max(Category.updated)).scalar_subquery()
+    result = await session.execute(
+        select(User.id, Setting.currency_id, categories_count, categories_updated)
+        .outerjoin(Setting, Setting.user_id == User.id)
+        .where(User.tg_id == tg_id)
+    )
+    row = result.first()
+    # Незарегистрированных не кэшируем, чтобы /start сразу подхватывался
+    if row is None:
+        return None
+
+    user_id, currency_id, categories_count, categories_updated = row
+    currency = get_currencies().get(currency_id)
+    user_ctx = UserContext(
+        user_id=user_id,
+        currency_id=currency_id,
+        currency_symbol=currency.display if currency else "₽",
+        categories_stamp=(categories_count, categories_updated),
+    )
+    if user_context_cache.ttl > 0:
+        user_context_cache.set(tg_id, user_ctx)
+    return user_ctx
+
+def invalidate_user_context(tg_id: int):
+    user_context_cache.pop(tg_id)
+
+class UserContextMiddleware(BaseMiddleware):
+    # Inner-middleware на message/callback_query: хендлер уже выбран, и контекст
+    # читается из базы, только если он объявил аргумент user_ctx. Навигация по меню
+    # без user_ctx лишнего запроса не делает.
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+        ) -> Any:
+        handler_object = data.get('handler')
+        wants_context = handler_object is None or 'user_ctx' in handler_object.params or handler_object.varkw
+        from_user = data.get('event_from_user')
+        if wants_context:
+            data['user_ctx'] = (
+                await resolve_user_context(data['session'], from_user.id) if from_user else None
+            )
+        return await handler(event, data)
@@ -0,0 +1,38 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+class TTLCache:
+    # Небольшой LRU с временем жизни записей; рассчитан на работу внутри одного event loop
+    def __init__(self, max_size: int = 10_000, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._items.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            return default
+
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -51,5 +51,10 @@ INSTRUCTION_TEXTS = [
 
     "11. <b>Смена валюты</b> — выбор валюты отображения (₽, $, €, и др.). Все суммы будут автоматически конвертироваться.\n"
     "12. <b>Меню статистики</b> — содержит команды для анализа данных: графики, история, суммарные показатели.\n"
-    "13. <b>Настройки</b> — управление валютой, категориями, лимитами и уведомлениями.\n"
+    "13. <b>Настройки</b> — управление валютой, категориями, лимитами и уведомлениями.\n",
+
+    "14. <b>/import</b> — загрузка выписки из CSV-файла с колонками <code>date,amount,currency,category,comment</code>. "
+    "Сумма с «+» — доход, без знака — расход. Новые категории создаются автоматически.\n"
+    "15. <b>/export</b> — выгрузка всей истории в CSV (или <code>/export xlsx</code>) с суммами в вашей валюте. "
+    "Файл совместим с /import.\n"
 ]
\ No newline at end of file
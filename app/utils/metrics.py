@@ -0,0 +1,263 @@
+import logging
+import math
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+from aiohttp import web
+from sqlalchemy import event
+
+# Минимальный реестр метрик в текстовом формате Prometheus; рассчитан на один event loop
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: dict | None = None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state["buckets"][index] += 1
+                break
+        state["sum"] += value
+        state["count"] += 1
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["buckets"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        # Функции, которые обновляют gauge прямо перед выдачей (размер пула, очередь графиков)
+        self._collectors: list[Callable[[], None]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception:
+                logging.exception("Ошибка при сборе метрик")
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+registry = MetricsRegistry()
+
+HANDLER_SECONDS = registry.histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта хендлером", ("router", "handler")
+)
+HANDLER_ERRORS = registry.counter(
+    "bot_handler_errors_total", "Исключения в хендлерах", ("router", "handler")
+)
+UPDATE_DB_STATEMENTS = registry.histogram(
+    "bot_update_db_statements", "Число SQL-запросов на один апдейт", ("router", "handler"),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+UPDATE_DB_SECONDS = registry.histogram(
+    "bot_update_db_seconds", "Суммарное время SQL-запросов на один апдейт", ("router", "handler")
+)
+DB_STATEMENT_SECONDS = registry.histogram(
+    "bot_db_statement_seconds", "Время выполнения одного SQL-запроса"
+)
+DB_POOL = registry.gauge(
+    "bot_db_pool_connections", "Состояние пула соединений", ("state",)
+)
+CHART_RENDER_SECONDS = registry.histogram(
+    "bot_chart_render_seconds", "Время отрисовки графика, включая ожидание в очереди", ("kind",)
+)
+CHART_REJECTED = registry.counter(
+    "bot_chart_rejected_total", "Графики, отклонённые из-за переполненной очереди"
+)
+CHART_PENDING = registry.gauge(
+    "bot_chart_pending", "Графики в работе и в очереди"
+)
+TELEGRAM_API_SECONDS = registry.histogram(
+    "bot_telegram_api_seconds", "Время вызова Bot API", ("method",)
+)
+TELEGRAM_API_ERRORS = registry.counter(
+    "bot_telegram_api_errors_total", "Ошибки вызовов Bot API", ("method", "error")
+)
+UPDATES_IN_FLIGHT = registry.gauge(
+    "bot_updates_in_flight", "Апдейты, которые сейчас обрабатываются хендлерами"
+)
+UPDATES_QUEUED = registry.gauge(
+    "bot_updates_queued", "Апдейты, ждущие своей очереди у пользователя или свободного слота"
+)
+UPDATES_SHED = registry.counter(
+    "bot_updates_shed_total", "Апдейты, отброшенные из-за переполненной очереди пользователя"
+)
+UPDATE_QUEUE_WAIT_SECONDS = registry.histogram(
+    "bot_update_queue_wait_seconds", "Ожидание апдейта в очереди до начала обработки"
+)
+LIMIT_ROLLOVER_LIMITS = registry.counter(
+    "bot_limit_rollover_limits_total", "Лимиты, обработанные продлением, по результату", ("result",)
+)
+LIMIT_ROLLOVER_CHUNKS = registry.counter(
+    "bot_limit_rollover_chunks_total", "Пачки, обработанные продлением лимитов"
+)
+LIMIT_ROLLOVER_SECONDS = registry.histogram(
+    "bot_limit_rollover_seconds", "Длительность продления лимитов целиком",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800),
+)
+OUTBOUND_ENQUEUED = registry.counter(
+    "bot_outbound_enqueued_total", "Сообщения, поставленные в очередь рассылки"
+)
+OUTBOUND_MESSAGES = registry.counter(
+    "bot_outbound_messages_total", "Попытки отправки из очереди рассылки по результату", ("result",)
+)
+OUTBOUND_LAG_SECONDS = registry.histogram(
+    "bot_outbound_lag_seconds", "Время от постановки сообщения в очередь до отправки",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+OUTBOUND_PENDING = registry.gauge(
+    "bot_outbound_pending", "Неотправленные сообщения в очереди рассылки"
+)
+
+@dataclass
+class UpdateStats:
+    # Накопитель на время одного апдейта; хендлер проставляется inner-middleware
+    router: str = "unhandled"
+    handler: str = "unhandled"
+    db_statements: int = 0
+    db_seconds: float = 0.0
+
+current_update: ContextVar[UpdateStats | None] = ContextVar("current_update", default=None)
+
+def instrument_engine(engine, pool_stats: Callable[[], dict]):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop("query_started", time.perf_counter())
+        DB_STATEMENT_SECONDS.observe(elapsed)
+
+        stats = current_update.get()
+        if stats is not None:
+            stats.db_statements += 1
+            stats.db_seconds += elapsed
+
+    def _collect_pool():
+        for state, value in pool_stats().items():
+            if isinstance(value, (int, float)):
+                DB_POOL.set(value, state=state)
+
+    registry.add_collector(_collect_pool)
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner | None:
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as error:
+        # Порт занят (например, вторым процессом бота на том же хосте) — бот работает без метрик
+        logging.warning("Не удалось открыть метрики на %s:%s: %s", host, port, error)
+        await runner.cleanup()
+        return None
+    logging.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
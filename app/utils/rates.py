@@ -0,0 +1,69 @@
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Mapping, Protocol
+from aiohttp import ClientSession, ClientTimeout
+
+# Лента курсов — JSON со снимком или списком снимков, курсы к базовой валюте (рублю):
+#   {"valid_from": "2026-10-18T00:00:00+00:00", "rates": {"USD": 91.2, "EUR": 98.4}}
+# Без valid_from снимок считается действующим с момента загрузки; в историю попадают
+# только курсы, которые отличаются от уже действующих.
+
+@dataclass(frozen=True)
+class RateQuote:
+    code: str
+    valid_from: datetime
+    rate: Decimal
+
+class RateProvider(Protocol):
+    async def fetch(self) -> list[RateQuote]: ...
+
+def _parse_valid_from(value: str | None) -> datetime:
+    if not value:
+        return datetime.now(timezone.utc)
+    moment = datetime.fromisoformat(value)
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+def parse_rate_feed(feed: Any) -> list[RateQuote]:
+    snapshots = feed if isinstance(feed, list) else [feed]
+    quotes = []
+    for snapshot in snapshots:
+        valid_from = _parse_valid_from(snapshot.get("valid_from"))
+        for code, rate in snapshot.get("rates", {}).items():
+            rate = Decimal(str(rate))
+            if rate <= 0:
+                raise ValueError(f"Некорректный курс {code}: {rate}")
+            quotes.append(RateQuote(code=code.upper(), valid_from=valid_from, rate=rate))
+    return quotes
+
+class FileRateProvider:
+    # Локальный файл: для тестов и ручного ввода курсов
+    def __init__(self, path: str):
+        self.path = path
+
+    async def fetch(self) -> list[RateQuote]:
+        with open(self.path, encoding="utf-8") as file:
+            return parse_rate_feed(json.load(file))
+
+class HttpRateProvider:
+    # Тот же формат по HTTP; в тестах подойдёт python -m http.server рядом с файлом
+    def __init__(self, url: str, timeout: float = 10):
+        self.url = url
+        self.timeout = timeout
+
+    async def fetch(self) -> list[RateQuote]:
+        async with ClientSession(timeout=ClientTimeout(total=self.timeout)) as session:
+            async with session.get(self.url) as response:
+                response.raise_for_status()
+                return parse_rate_feed(await response.json(content_type=None))
+
+def make_rate_provider(env: Mapping[str, str] = os.environ) -> RateProvider | None:
+    # RATES_SOURCE — путь к файлу или http(s)-адрес; без него курсы остаются статичными
+    source = env.get('RATES_SOURCE')
+    if not source:
+        return None
+    if source.startswith(("http://", "https://")):
+        return HttpRateProvider(source)
+    return FileRateProvider(source)
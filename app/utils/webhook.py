@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Mapping
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+@dataclass(frozen=True)
+class WebhookSettings:
+    # Публичный адрес, который получит Telegram; без него webhook не регистрируется
+    # (например, когда его ставят вручную или апдейты шлёт локальный скрипт)
+    base_url: str | None
+    path: str = "/webhook"
+    secret_token: str | None = None
+    host: str = "0.0.0.0"
+    port: int = 8080
+    max_connections: int = 64
+    drop_pending_updates: bool = False
+
+    @property
+    def url(self) -> str | None:
+        return self.base_url.rstrip("/") + self.path if self.base_url else None
+
+def load_webhook_settings(env: Mapping[str, str] = os.environ) -> WebhookSettings:
+    path = env.get('WEBHOOK_PATH', '/webhook')
+    return WebhookSettings(
+        base_url=env.get('WEBHOOK_URL') or None,
+        path=path if path.startswith("/") else "/" + path,
+        secret_token=env.get('WEBHOOK_SECRET') or None,
+        host=env.get('WEBHOOK_HOST', '0.0.0.0'),
+        port=int(env.get('WEBHOOK_PORT', '8080')),
+        max_connections=int(env.get('WEBHOOK_MAX_CONNECTIONS', '64')),
+        drop_pending_updates=env.get('WEBHOOK_DROP_PENDING', '').lower() in ("1", "true", "yes"),
+    )
+
+class BackgroundRequestHandler(SimpleRequestHandler):
+    # Telegram получает 200 сразу, апдейт обрабатывается в фоне. Своего лимита здесь нет:
+    # параллельность и очереди по чатам держат UpdateScheduler и ChatEventIsolation, иначе апдейты,
+    # ждущие очереди своего чата, занимали бы общие слоты
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+
+    async def _background_feed_update(self, bot: Bot, update: dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        except Exception:
+            # feed_raw_update не пишет ошибку в лог (в отличие от polling), а задачу
+            # никто не ждёт — без этого исключение потерялось бы
+            logging.exception("Ошибка обработки апдейта")
+
+async def run_webhook(dp: Dispatcher, bot: Bot, settings: WebhookSettings):
+    app = web.Application()
+    BackgroundRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=settings.secret_token,
+    ).register(app, path=settings.path)
+    # startup/shutdown диспетчера привязываются к жизненному циклу приложения
+    setup_application(app, dp, bot=bot)
+
+    if settings.url:
+        async def register_webhook():
+            await bot.set_webhook(
+                settings.url,
+                secret_token=settings.secret_token,
+                # Telegram принимает от 1 до 100 одновременных соединений
+                max_connections=max(1, min(settings.max_connections, 100)),
+                drop_pending_updates=settings.drop_pending_updates,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logging.info("Webhook зарегистрирован: %s", settings.url)
+        dp.startup.register(register_webhook)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, settings.host, settings.port).start()
+    logging.info("Принимаю апдейты на http://%s:%s%s", settings.host, settings.port, settings.path)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,134 @@
+"""Локальный фейковый Bot API сервер с лимитами Telegram.
+
+Запуск:
+    python -m benchmarks.fake_bot_api --port 8081 --chat-rate 1 --global-rate 30
+    BOT_API_URL=http://127.0.0.1:8081 TOKEN=42:fake python run.py
+
+Отвечает на любые методы: sendMessage возвращает сообщение, getMe — бота, остальное — true.
+Сверх лимитов (по чату и общего) отвечает 429 с retry_after, как настоящий Telegram.
+Чаты из --blocked-chats отвечают 403 «bot was blocked by the user».
+GET /stats — JSON со счётчиками запросов.
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import defaultdict, deque
+from aiohttp import web
+
+class FakeBotApi:
+    def __init__(self, chat_rate: float = 1, global_rate: float = 30, latency: float = 0.0,
+                 blocked_chats: set[int] | None = None):
+        self.chat_rate = chat_rate
+        self.global_rate = global_rate
+        self.latency = latency
+        self.blocked_chats = blocked_chats or set()
+        self.stats: dict[str, int] = defaultdict(int)
+        # Сообщения в порядке доставки по чатам — для проверки порядка
+        self.delivered: dict[int, list[str]] = defaultdict(list)
+        self.delivered_at: list[float] = []
+        self._global_window: deque[float] = deque()
+        self._chat_windows: dict[int, deque[float]] = defaultdict(deque)
+        self._message_id = 0
+
+    @staticmethod
+    def _over_limit(window: deque, rate: float, now: float) -> float:
+        # Скользящее окно в одну секунду; возвращает, через сколько освободится место
+        while window and window[0] <= now - 1:
+            window.popleft()
+        if len(window) >= max(1, rate):
+            return window[0] + 1 - now
+        window.append(now)
+        return 0.0
+
+    def _error(self, code: int, description: str, **parameters) -> web.Response:
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = dict(await request.post())
+        self.stats[f"{method}_requests"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getme":
+            return web.json_response({"ok": True, "result": {
+                "id": 42, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+            }})
+        if method != "sendmessage":
+            return web.json_response({"ok": True, "result": True})
+
+        chat_id = int(params["chat_id"])
+        if chat_id in self.blocked_chats:
+            self.stats["forbidden"] += 1
+            return self._error(403, "Forbidden: bot was blocked by the user")
+
+        now = time.monotonic()
+        wait = self._over_limit(self._global_window, self.global_rate, now)
+        if not wait:
+            wait = self._over_limit(self._chat_windows[chat_id], self.chat_rate, now)
+            if wait:
+                # Место в общем окне уже заняли, а сообщение не ушло
+                self._global_window.pop()
+        if wait:
+            self.stats["too_many_requests"] += 1
+            retry_after = max(1, math.ceil(wait))
+            return self._error(429, f"Too Many Requests: retry after {retry_after}", retry_after=retry_after)
+
+        self._message_id += 1
+        self.stats["delivered"] += 1
+        self.delivered[chat_id].append(params.get("text", ""))
+        self.delivered_at.append(now)
+        return web.json_response({"ok": True, "result": {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.stats))
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+async def start_fake_bot_api(api: FakeBotApi, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+    runner = web.AppRunner(api.make_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+async def main(args):
+    api = FakeBotApi(
+        chat_rate=args.chat_rate,
+        global_rate=args.global_rate,
+        latency=args.latency_ms / 1000,
+        blocked_chats={int(chat_id) for chat_id in args.blocked_chats.split(",") if chat_id},
+    )
+    runner = await start_fake_bot_api(api, args.host, args.port)
+    print(f"Fake Bot API: http://{args.host}:{args.port}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(json.dumps(dict(api.stats), indent=2))
+        await runner.cleanup()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chat-rate", type=float, default=1, help="Сообщений в секунду на чат")
+    parser.add_argument("--global-rate", type=float, default=30, help="Сообщений в секунду всего")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--blocked-chats", default="", help="chat_id через запятую, отвечающие 403")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,157 @@
+"""Генератор синтетического журнала для бенчмарков.
+
+Детерминирован по seed: одинаковые параметры дают одинаковую базу на SQLite и Postgres.
+"""
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from app.database.models import Base, Category, Currency, Limit, Setting, Transaction, User
+from app.database.orm_query import orm_rebuild_limit_spent
+from app.database.rollups import orm_rebuild_rollups
+from app.utils.constants import CURRENCIES
+
+# Готовые размеры: от быстрой проверки до нагрузки крупного продакшена
+SCALES = {
+    "1k": {"transactions": 1_000, "users": 10},
+    "100k": {"transactions": 100_000, "users": 200},
+    "1m": {"transactions": 1_000_000, "users": 1_000},
+    "10m": {"transactions": 10_000_000, "users": 10_000},
+}
+
+@dataclass(frozen=True)
+class LedgerScale:
+    transactions: int = 100_000
+    users: int = 200
+    categories_per_user: int = 10
+    # Доля категорий, удалённых больше 30 дней назад (работа для очистки)
+    deleted_share: float = 0.1
+    # Доля лимитов с истёкшим периодом (работа для продления)
+    expired_limit_share: float = 0.5
+    # Доля всех транзакций у самого активного пользователя
+    heavy_user_share: float = 0.2
+    history_days: int = 3 * 365
+    seed: int = 42
+
+@dataclass(frozen=True)
+class Ledger:
+    users: int
+    categories_per_user: int
+    transactions: int
+    heavy_user_id: int
+
+    def category_id(self, user_id: int, n: int) -> int:
+        return (user_id - 1) * self.categories_per_user + n + 1
+
+async def generate_ledger(engine: AsyncEngine, scale: LedgerScale, batch_size: int = 10_000) -> Ledger:
+    rng = random.Random(scale.seed)
+    now = datetime.now(timezone.utc)
+    cpu = scale.categories_per_user
+    user_ids = range(1, scale.users + 1)
+    ledger = Ledger(scale.users, cpu, scale.transactions, heavy_user_id=1)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        if await conn.scalar(select(func.count()).select_from(User)):
+            raise RuntimeError("База не пуста: генератор работает только с чистой базой")
+
+        await conn.execute(insert(Currency), [
+            {"id": n, **currency} for n, currency in enumerate(CURRENCIES, start=1)
+        ])
+        await conn.execute(insert(User), [
+            {"id": user_id, "tg_id": 10_000_000 + user_id, "username": f"user{user_id}"}
+            for user_id in user_ids
+        ])
+        await conn.execute(insert(Setting), [
+            {"user_id": user_id, "currency_id": rng.randint(1, len(CURRENCIES))}
+            for user_id in user_ids
+        ])
+
+        deleted_at = now - timedelta(days=45)
+        await conn.execute(insert(Category), [
+            {
+                "id": ledger.category_id(user_id, n),
+                "user_id": user_id,
+                "name": f"Категория {n}",
+                "is_deleted": deleted,
+                "deleted_at": deleted_at if deleted else None,
+            }
+            for user_id in user_ids
+            for n in range(cpu)
+            # Первая категория пользователя никогда не удаляется — на ней меряются лимиты
+            for deleted in [n > 0 and rng.random() < scale.deleted_share]
+        ])
+
+        limits = []
+        for user_id in user_ids:
+            for n in range(min(3, cpu)):
+                period_days = rng.choice((7, 30))
+                expired = rng.random() < scale.expired_limit_share
+                start_date = now - timedelta(days=period_days * (3 if expired else 0) + rng.randint(0, period_days - 1))
+                limits.append({
+                    "user_id": user_id,
+                    "category_id": ledger.category_id(user_id, n),
+                    "currency_id": rng.randint(1, len(CURRENCIES)),
+                    "limit_amount": rng.choice((5_000, 20_000, 100_000)),
+                    "period": f"{period_days}d",
+                    "period_days": period_days,
+                    "is_updating": True,
+                    "start_date": start_date,
+                    "end_date": start_date + timedelta(days=period_days),
+                })
+        await conn.execute(insert(Limit), limits)
+
+        if conn.dialect.name == "postgresql":
+            # id выше заданы явно — сдвигаем последовательности, иначе следующие INSERT упрутся в PK
+            for table in (Currency.__table__, User.__table__, Category.__table__):
+                await conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), (SELECT max(id) FROM {table.name}))"
+                ))
+
+    rates = {n: Decimal(str(currency["rate_to_base"])) for n, currency in enumerate(CURRENCIES, start=1)}
+    for offset in range(0, scale.transactions, batch_size):
+        batch = []
+        for _ in range(min(batch_size, scale.transactions - offset)):
+            user_id = ledger.heavy_user_id if rng.random() < scale.heavy_user_share else rng.randint(1, scale.users)
+            # Порядок вызовов rng прежний: тот же seed даёт ту же базу
+            category_id = ledger.category_id(user_id, rng.randrange(cpu))
+            # Основная масса в рублях, остальное — в других валютах
+            currency_id = 1 if rng.random() < 0.7 else rng.randint(2, len(CURRENCIES))
+            amount = Decimal(str(round(rng.uniform(10, 5000), 2)))
+            batch.append({
+                "user_id": user_id,
+                "category_id": category_id,
+                "currency_id": currency_id,
+                "amount": amount,
+                "amount_base": amount * rates[currency_id],
+                "is_expense": rng.random() < 0.85,
+                "comment": "",
+                "created": now - timedelta(seconds=rng.randint(0, scale.history_days * 86400)),
+            })
+        async with engine.begin() as conn:
+            await conn.execute(insert(Transaction), batch)
+
+    # Сводки и счётчики лимитов считаются так же, как при старте бота
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_maker() as session:
+        await orm_rebuild_rollups(session)
+        await orm_rebuild_limit_spent(session)
+        await session.commit()
+
+    return ledger
+
+async def describe_ledger(engine: AsyncEngine, categories_per_user: int = 10) -> Ledger:
+    # Параметры уже сгенерированной базы: самый активный пользователь — тот, у кого больше всего операций
+    async with engine.connect() as conn:
+        users = await conn.scalar(select(func.count()).select_from(User))
+        transactions = await conn.scalar(select(func.count()).select_from(Transaction))
+        heavy_user_id = await conn.scalar(
+            select(Transaction.user_id)
+            .group_by(Transaction.user_id)
+            .order_by(func.count().desc())
+            .limit(1)
+        )
+    return Ledger(users, categories_per_user, transactions, heavy_user_id or 1)
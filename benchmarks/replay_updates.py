@@ -0,0 +1,107 @@
+"""Отправка записанных апдейтов в локально запущенный бот в режиме webhook.
+
+Запуск:
+    RUN_MODE=webhook WEBHOOK_SECRET=s3cret python run.py
+    python -m benchmarks.replay_updates --url http://127.0.0.1:8080/webhook --secret s3cret updates.jsonl
+    python -m benchmarks.replay_updates --url http://127.0.0.1:8080/webhook --synthetic 1000 --concurrency 50
+    python -m benchmarks.replay_updates --synthetic 1000 --heavy-users 3 --concurrency 50
+
+Файл — JSON-массив апдейтов или JSONL (по апдейту на строку), как их отдаёт getUpdates.
+update_id переписываются по порядку, чтобы один файл можно было прогонять многократно.
+Результат — JSON с кодами ответов и временем ответа webhook.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+from aiohttp import ClientSession
+
+MENU_BUTTONS = ("💸Все расходы", "💰Все доходы", "📊Статистика", "🗃️Категории", "⚙️Настройки", "🔙Назад")
+# Тяжёлые пользователи без остановки запрашивают график — проверка, что остальные не ждут их
+HEAVY_BUTTON = "🗓️Полугодовой отчет"
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as file:
+        content = file.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+def synthetic_updates(count: int, users: int, first_tg_id: int, heavy_users: int = 0) -> list[dict]:
+    # Нажатия кнопок меню от нескольких пользователей; /start первым, чтобы они были зарегистрированы.
+    # Первые heavy_users пользователей вместо меню шлют полугодовой отчёт
+    updates = []
+    for n in range(count):
+        tg_id = first_tg_id + n % users
+        if n < users:
+            text = "/start"
+        elif n % users < heavy_users:
+            text = HEAVY_BUTTON
+        else:
+            text = MENU_BUTTONS[n % len(MENU_BUTTONS)]
+        updates.append({
+            "message": {
+                "message_id": n + 1,
+                "date": int(time.time()),
+                "chat": {"id": tg_id, "type": "private"},
+                "from": {"id": tg_id, "is_bot": False, "first_name": "Replay", "username": f"replay{tg_id}"},
+                "text": text,
+            }
+        })
+    return updates
+
+async def replay(url: str, secret: str | None, updates: list[dict], concurrency: int) -> dict:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    update_ids = itertools.count(int(time.time()) * 1000)
+    statuses: dict[int, int] = {}
+    timings = []
+
+    async def post(session: ClientSession, update: dict):
+        payload = {**update, "update_id": next(update_ids)}
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(url, json=payload, headers=headers) as response:
+                await response.read()
+                timings.append((time.perf_counter() - started) * 1000)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(post(session, update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        "updates": len(updates),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(updates) / elapsed, 1) if elapsed else None,
+        "statuses": statuses,
+        "median_ms": round(statistics.median(timings), 3) if timings else None,
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3) if timings else None,
+        "max_ms": round(timings[-1], 3) if timings else None,
+    }
+
+async def main(args):
+    if args.file:
+        updates = load_updates(args.file)
+    else:
+        updates = synthetic_updates(args.synthetic, args.users, args.first_tg_id, args.heavy_users)
+
+    updates = updates * args.repeat
+    print(json.dumps(await replay(args.url, args.secret, updates, args.concurrency), indent=2))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", nargs="?", help="JSON или JSONL с апдейтами")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--synthetic", type=int, default=100, help="Число синтетических апдейтов, если файл не указан")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--heavy-users", type=int, default=0, help="Сколько пользователей спамят полугодовым отчётом")
+    parser.add_argument("--first-tg-id", type=int, default=900_000_000)
+    asyncio.run(main(parser.parse_args()))
@@ -1,15 +1,34 @@
+import argparse
 import asyncio
 import logging
 import os
+from datetime import timedelta
 from aiogram import Bot, Dispatcher
-from app.background.scheduler import setup_scheduler
+from aiogram.filters import ExceptionTypeFilter
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.memory import MemoryStorage
 
 from dotenv import find_dotenv, load_dotenv
 load_dotenv(find_dotenv())
 
+from app.background.scheduler import rate_provider, setup_scheduler
+from app.background.tasks import update_currency_rates
+from app.background.outbound import outbound
+
 from app.middlewares.db import DataBaseSession
+from app.middlewares.user_context import UserContextMiddleware
+from app.middlewares.metrics import HandlerLabelMiddleware, MetricsMiddleware, TelegramApiMetrics
+from app.middlewares.update_scheduler import ChatEventIsolation, UpdateScheduler, UpdateShed, answer_shed_update
 
 from app.database.engine import create_db, drop_db, session_maker
+from app.database.fsm_storage import SQLAlchemyStorage
+from app.database.rollups import orm_ensure_rollups
+from app.database.orm_query import orm_ensure_limit_spent
+from app.database.currency_cache import load_currencies
+from app.charts.pool import renderer
+from app.utils.metrics import start_metrics_server
+from app.utils.webhook import load_webhook_settings, run_webhook
 
 import app.handlers.categories as categories 
 import app.handlers.transactions as transactions
@@ -17,15 +36,59 @@ import app.handlers.statistics as statistics
 import app.handlers.limits as limits
 import app.handlers.menu as menu
 import app.handlers.currencies as currencies
+import app.handlers.ledger as ledger
 
-bot = Bot(token = os.getenv('TOKEN'))
-dp = Dispatcher()
+def make_fsm_storage():
+    # По умолчанию FSM в базе: незаконченный сценарий переживает перезапуск
+    # и виден всем процессам бота; memory — только для одного процесса
+    if os.getenv('FSM_STORAGE', 'db') == 'memory':
+        return MemoryStorage()
+    ttl_hours = float(os.getenv('FSM_STATE_TTL_HOURS', '24'))
+    return SQLAlchemyStorage(session_maker, ttl=timedelta(hours=ttl_hours) if ttl_hours > 0 else None)
 
-async def main():
-    setup_scheduler()
+def make_bot_session():
+    # BOT_API_URL — свой Bot API сервер (локальный telegram-bot-api или фейк из benchmarks)
+    api_url = os.getenv('BOT_API_URL')
+    if api_url:
+        return AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+    return None
+
+bot = Bot(token = os.getenv('TOKEN'), session = make_bot_session())
+bot.session.middleware(TelegramApiMetrics())
+# Апдейты одного чата идут строго по очереди: FSM читает состояние уже под замком чата
+dp = Dispatcher(
+    storage=make_fsm_storage(),
+    events_isolation=ChatEventIsolation(max_queue_per_chat=int(os.getenv('UPDATE_USER_QUEUE', '3'))),
+)
+dp.errors.register(answer_shed_update, ExceptionTypeFilter(UpdateShed))
+
+async def main(mode: str):
     await create_db()
     #await drop_db()
+    async with session_maker() as session:
+        await load_currencies(session)
+        # Первая загрузка курсов — до пересборки сводных таблиц и заполнения amount_base,
+        # чтобы rate_to_base не поменялся между ними
+        if rate_provider is not None:
+            try:
+                await update_currency_rates(session, rate_provider)
+            except Exception:
+                logging.exception("Не удалось загрузить курсы валют при старте")
+        await orm_ensure_rollups(session)
+        await orm_ensure_limit_spent(session)
+    # Планировщик — только после миграций и пересборки сводных таблиц:
+    # разовые задачи запускаются сразу и рассчитывают на готовую схему
+    setup_scheduler()
+
+    # Общий лимит самым первым: ждущий апдейт не держит сессию БД и не попадает в замер хендлера
+    dp.update.middleware(UpdateScheduler(max_in_flight=int(os.getenv('UPDATE_MAX_IN_FLIGHT', '16'))))
+    # Метрики следом: в замер попадает и работа остальных middleware
+    dp.update.middleware(MetricsMiddleware())
     dp.update.middleware(DataBaseSession(session_pool = session_maker))
+    dp.message.middleware(HandlerLabelMiddleware())
+    dp.callback_query.middleware(HandlerLabelMiddleware())
+    dp.message.middleware(UserContextMiddleware())
+    dp.callback_query.middleware(UserContextMiddleware())
 
     dp.include_router(categories.router)
     dp.include_router(transactions.router)
@@ -33,12 +96,35 @@ async def main():
     dp.include_router(limits.router)
     dp.include_router(menu.router)
     dp.include_router(currencies.router)
+    dp.include_router(ledger.router)
+
+    metrics_runner = None
+    # Экспортёр включается явно: у каждого процесса бота на хосте должен быть свой порт
+    metrics_port = os.getenv('METRICS_PORT', '')
+    if metrics_port:
+        metrics_runner = await start_metrics_server(os.getenv('METRICS_HOST', '127.0.0.1'), int(metrics_port))
 
-    await dp.start_polling(bot)
+    outbound.start(bot)
+    try:
+        if mode == 'webhook':
+            await run_webhook(dp, bot, load_webhook_settings())
+        else:
+            # Пока на боте висит webhook, getUpdates не работает
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await outbound.stop()
+        renderer.shutdown()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default=os.getenv('RUN_MODE', 'polling'))
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO)
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.mode))
     except KeyboardInterrupt:
         print('Exit')